@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+
+
+class PlanCache:
+    """
+    Bounded LRU cache of plans. The keys are the joint positions and the
+    offset rounded to a grid, so requests differing less than the
+    tolerances share the same plan.
+    """
+
+    def __init__(self, size, q_tolerance, offset_tolerance):
+        self.size = size
+        self.q_tolerance = q_tolerance
+        self.offset_tolerance = offset_tolerance
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, q, offset):
+        return (
+            tuple(round(v / self.q_tolerance) for v in q),
+            tuple(round(v / self.offset_tolerance) for v in offset),
+        )
+
+    def get(self, key):
+        with self.lock:
+            if (value := self.entries.get(key)) is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def report(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,119 @@
+import os
+import asyncio
+from collections import defaultdict
+
+import aiomqtt
+from websockets.asyncio.client import connect as ws_connect
+
+import moonraker
+
+
+MQTT_BROKER_URL = os.environ["MQTT_BROKER_URL"]
+MQTT_BROKER_PORT = int(os.environ.get("MQTT_BROKER_PORT", 1883))
+MOONRAKER_URL = os.environ["MOONRAKER_URL"]
+
+# seconds between the pings of moonraker, and how long to wait for a pong
+HEALTH_INTERVAL = float(os.environ.get("MOONRAKER_HEALTH_INTERVAL", 5))
+HEALTH_TIMEOUT = float(os.environ.get("MOONRAKER_HEALTH_TIMEOUT", 2))
+# the delay before reconnecting doubles after each failure, up to the max
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30
+# how long a request waits for the connection before failing
+CONNECT_TIMEOUT = float(os.environ.get("MOONRAKER_CONNECT_TIMEOUT", 10))
+
+
+class Connection:
+    """
+    The long-lived connections to moonraker and the mqtt broker, shared by
+    all the requests. A background task opens both, pings moonraker
+    periodically, and reconnects with backoff when anything fails.
+
+    The subscriptions survive the reconnections: the callbacks are kept
+    here, and the printer objects are subscribed again on each connection.
+    """
+
+    def __init__(self):
+        self.rpc = None
+        self.mqtt = None
+        self.ready = asyncio.Event()
+        self.callbacks = defaultdict(list)
+        self.objects = {}
+        self.task = None
+        self.connects = 0
+        self.failures = 0
+        self.last_error = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        delay = BACKOFF_MIN
+        while True:
+            try:
+                async with aiomqtt.Client(MQTT_BROKER_URL, port=MQTT_BROKER_PORT) as mqtt:
+                    async with ws_connect(MOONRAKER_URL) as ws:
+                        rpc = moonraker.Client(ws, self.callbacks)
+                        async with asyncio.TaskGroup() as tasks:
+                            tasks.create_task(rpc.dispatch())
+                            tasks.create_task(self._check(ws))
+                            if self.objects:
+                                await rpc.call("printer.objects.subscribe", {"objects": self.objects})
+
+                            self.mqtt, self.rpc = mqtt, rpc
+                            self.connects += 1
+                            self.ready.set()
+                            delay = BACKOFF_MIN
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, ExceptionGroup):
+                    e = e.exceptions[0]
+                self.failures += 1
+                self.last_error = repr(e)
+                print(f"connection lost: {e!r}, retrying in {delay}s")
+            finally:
+                self.ready.clear()
+                self.mqtt = self.rpc = None
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+
+    async def _check(self, ws):
+        # returns only by raising, when moonraker does not answer
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            pong = await ws.ping()
+            await asyncio.wait_for(pong, HEALTH_TIMEOUT)
+
+    async def client(self):
+        await asyncio.wait_for(self.ready.wait(), CONNECT_TIMEOUT)
+        return self.rpc
+
+    def subscribe(self, method, callback):
+        self.callbacks[method].append(callback)
+
+    async def subscribe_objects(self, objects):
+        """
+        Adds the printer objects (name -> fields, None for all) to the
+        subscription, whose updates come as notify_status_update. Returns
+        the current status of the objects.
+        """
+        self.objects.update(objects)
+        rpc = await self.client()
+        return await rpc.call("printer.objects.subscribe", {"objects": self.objects})
+
+    def report(self):
+        return {
+            "connected": self.ready.is_set(),
+            "connects": self.connects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,105 @@
+import os
+import json
+import bisect
+from collections import deque
+
+import numpy as np
+
+# the topic of the progress of the execution, one message per gcode
+EXECUTE_TOPIC = os.environ.get("EXECUTE_TOPIC", "/arm/execute")
+# the latencies are kept for the last LATENCY_WINDOW gcodes
+LATENCY_WINDOW = int(os.environ.get("LATENCY_WINDOW", 1000))
+# upper bounds of the buckets, in s
+BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+
+class Histogram:
+    """
+    Rolling histogram of the latest latencies
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def report(self):
+        if not self.samples:
+            return {"count": 0}
+
+        counts = [0] * (len(BUCKETS) + 1)
+        for v in self.samples:
+            counts[bisect.bisect_left(BUCKETS, v)] += 1
+
+        p50, p90, p99 = np.percentile(self.samples, [50, 90, 99]).tolist()
+        return {
+            "count": len(self.samples),
+            "p50": p50,
+            "p90": p90,
+            "p99": p99,
+            "max": max(self.samples),
+            "buckets": {
+                **{f"le_{b}": c for b, c in zip(BUCKETS, counts)},
+                "inf": counts[-1],
+            },
+        }
+
+
+# from sending a gcode to moonraker's reply, i.e. klipper has queued it
+ack_latency = Histogram()
+# from sending a gcode to the end of its motion
+complete_latency = Histogram()
+
+
+class Progress:
+    """
+    The events of one execution. Each gcode is published when moonraker
+    acknowledges it, and again when its motion is known to be complete,
+    unless both happen at once. A gcode is complete when a later M400
+    returns.
+    """
+
+    def __init__(self, mqtt):
+        self.mqtt = mqtt
+        self.waiting = []
+
+    async def acked(self, index, gcode, sent, acked, complete):
+        event = {
+            "index": index,
+            "gcode": gcode,
+            "sent": sent,
+            "acked": acked,
+            "completed": None,
+        }
+        ack_latency.record(acked - sent)
+
+        if complete:
+            await self.completed(acked, event)
+        else:
+            self.waiting.append(event)
+            await self._publish(event)
+
+    async def completed(self, when, *events):
+        # the given events, and all the waiting ones before them
+        for event in self.waiting + list(events):
+            event["completed"] = when
+            complete_latency.record(when - event["sent"])
+            await self._publish(event)
+        self.waiting = []
+
+    async def _publish(self, event):
+        if self.mqtt is None:
+            return
+        try:
+            await self.mqtt.publish(EXECUTE_TOPIC, json.dumps(event))
+        except Exception as e:
+            # the motion goes on without the progress
+            print(f"failed to publish the progress: {e!r}")
+
+
+def report():
+    return {
+        "ack": ack_latency.report(),
+        "complete": complete_latency.report(),
+    }
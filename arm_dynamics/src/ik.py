@@ -0,0 +1,306 @@
+import itertools
+
+import numpy as np
+
+EPS = 1e-9
+# the urdf rounds the angles (e.g. 3.1416 for pi), so the axes are only
+# nearly parallel/perpendicular/intersecting.
+GEOMETRY_TOLERANCE = 1e-3
+# the closed-form solutions are polished with a few newton steps, and then
+# verified with the forward kinematics
+NEWTON_STEPS = 2
+TOLERANCE = 1e-6
+# J5 closer to 0 (or pi) than this is a singular wrist
+SINGULAR = 1e-3
+
+# the numerical solver converges if the pose error (in m and rad) is
+# within DLS_TOLERANCE
+DLS_ITERATIONS = 100
+DLS_TOLERANCE = 1e-5
+DLS_DAMPING = 1e-3
+DLS_DAMPING_MIN = 1e-9
+DLS_DAMPING_MAX = 1e3
+
+
+def _angle(v):
+    return np.arctan2(v[1], v[0])
+
+
+def _wrap(q):
+    return (q + np.pi) % (2 * np.pi) - np.pi
+
+
+def _rotz(q):
+    c, s = np.cos(q), np.sin(q)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+class AnalyticIK:
+    """
+    Closed-form inverse kinematics of the PAROL6, decoupling the position of
+    the wrist center (J1 ~ J3) from the orientation of the spherical wrist
+    (J4 ~ J6). Up to 8 solutions exist for a pose: shoulder front/back,
+    elbow up/down and wrist flipped or not.
+
+    The geometry is taken from the chain at construction, together with a
+    check that it has the expected structure: J2 and J3 parallel and
+    perpendicular to J1, and the axes of J4 ~ J6 meeting in one point.
+    """
+
+    def __init__(self, chain):
+        if chain.n != 6 or not np.allclose(chain.axes, [0, 0, 1]):
+            raise ValueError("expecting 6 joints rotating about their z-axis")
+
+        self.chain = chain
+        S = chain.statics
+        ez = np.array([0.0, 0.0, 1.0])
+
+        joints, Te = chain.frames(np.zeros(6))
+        joints, Te = joints[0], Te[0]
+
+        # the wrist center in the flange frame is independent of the joints
+        self.wc_flange = np.linalg.inv(Te) @ joints[4, :, 3]
+
+        # everything else in the frame of J1 (at q1 = 0)
+        self.base_inv = np.linalg.inv(S[0])
+        joints = self.base_inv @ joints
+
+        p2, p3, wc = joints[1, :3, 3], joints[2, :3, 3], joints[4, :3, 3]
+        a2 = joints[1, :3, 2]
+        a3 = joints[2, :3, 2]
+
+        if abs(a2 @ ez) > GEOMETRY_TOLERANCE or abs(abs(a2 @ a3) - 1) > GEOMETRY_TOLERANCE:
+            raise ValueError("J2 and J3 must be parallel and perpendicular to J1")
+
+        # the arm moves in the plane spanned by h and ez, at the offset d
+        # along the axis of J2
+        self.a2 = a2 = a2 - (a2 @ ez) * ez
+        self.h = np.cross(a2, ez)
+        self.h /= np.linalg.norm(self.h)
+        self.d = p2 @ a2
+        if (
+            abs(p3 @ a2 - self.d) > GEOMETRY_TOLERANCE or
+            abs(wc @ a2 - self.d) > GEOMETRY_TOLERANCE
+        ):
+            raise ValueError("the arm is not planar")
+
+        for j in (3, 5):
+            r = wc - joints[j, :3, 3]
+            if np.linalg.norm(np.cross(r, joints[j, :3, 2])) > GEOMETRY_TOLERANCE:
+                raise ValueError("the wrist is not spherical")
+
+        def _planar(p):
+            return np.array([p @ self.h, p @ ez])
+
+        self.p2 = _planar(p2)
+        la = _planar(p3) - self.p2
+        lc = _planar(wc) - _planar(p3)
+        self.la, self.lc = np.linalg.norm(la), np.linalg.norm(lc)
+        self.ba0, self.bc0 = _angle(la), _angle(lc)
+        self.s3 = np.sign(a2 @ a3)
+
+        # R4^T R = Rz(q4) S4 Rz(q5) S5 Rz(q6) tool = Rz(a) Rm(b) Rk(c) S4 S5 tool
+        # with m = S4 ez and k = S4 S5 ez.
+        S4, S5 = S[4, :3, :3], S[5, :3, :3]
+        m = S4 @ ez
+        k = S4 @ S5 @ ez
+        if abs(m @ ez) > GEOMETRY_TOLERANCE or abs(abs(k @ ez) - 1) > GEOMETRY_TOLERANCE:
+            raise ValueError("unexpected wrist geometry")
+        self.wrist_inv = (S4 @ S5 @ chain.tool[:3, :3]).T
+        self.delta = _angle(m)
+        self.sk = np.sign(k @ ez)
+
+    def _arm(self, w):
+        # solutions of J1 ~ J3 placing the wrist center at w (in the frame
+        # of J1 without its rotation)
+        r = np.hypot(w[0], w[1])
+        if r < abs(self.d) + EPS:
+            return []
+
+        solutions = []
+        for sign in (1, -1):
+            q1 = _angle(w) - _angle(self.a2) - sign * np.arccos(self.d / r)
+            wr = _rotz(-q1) @ w
+            dx, dz = np.array([wr @ self.h, wr[2]]) - self.p2
+            D2 = dx * dx + dz * dz
+            cg = (D2 - self.la ** 2 - self.lc ** 2) / (2 * self.la * self.lc)
+            if abs(cg) > 1 + EPS:
+                continue
+            g = np.arccos(np.clip(cg, -1, 1))
+
+            for gamma in ((g, -g) if g > EPS else (g,)):
+                ba = np.arctan2(dz, dx) - np.arctan2(
+                    self.lc * np.sin(gamma), self.la + self.lc * np.cos(gamma)
+                )
+                q2 = self.ba0 - ba
+                q3 = self.s3 * (self.bc0 - self.ba0 - gamma)
+                solutions.append((q1, q2, q3))
+
+        return solutions
+
+    def _wrist(self, N, hint):
+        # decompose N = Rz(a) Rx(b) Rz(c) (ZXZ euler angles)
+        solutions = []
+        b = np.arccos(np.clip(N[2, 2], -1, 1))
+        if np.sin(b) < SINGULAR:
+            # gimbal lock, only a + c (or a - c) is determined
+            a = hint + self.delta
+            if N[2, 2] > 0:
+                c = np.arctan2(N[1, 0], N[0, 0]) - a
+            else:
+                c = a - np.arctan2(N[1, 0], N[0, 0])
+            solutions.append((a, b, c))
+        else:
+            for b in (b, -b):
+                sb = np.sin(b)
+                a = np.arctan2(N[0, 2] / sb, -N[1, 2] / sb)
+                c = np.arctan2(N[2, 0] / sb, N[2, 1] / sb)
+                solutions.append((a, b, c))
+
+        return [
+            (a - self.delta, b, self.sk * (c + self.delta))
+            for a, b, c in solutions
+        ]
+
+    def solve(self, T, qlim, hint=None):
+        """
+        All the joint angles within qlim reaching the pose T (4x4 array),
+        as an array of shape (M, 6). hint is used when the wrist is
+        singular and the rotations of J4 and J6 are ambiguous.
+        """
+        hint = np.zeros(6) if hint is None else np.asarray(hint)
+        w = (self.base_inv @ T @ self.wc_flange)[:3]
+
+        arm = self._arm(w)
+        if not arm:
+            return np.empty((0, 6))
+
+        Q = np.zeros((len(arm), 6))
+        Q[:, :3] = arm
+        joints, _ = self.chain.frames(Q)
+
+        candidates = []
+        for q, R4 in zip(arm, joints[:, 3, :3, :3]):
+            N = R4.T @ T[:3, :3] @ self.wrist_inv
+            for wrist in self._wrist(N, hint[3]):
+                candidates.append([*q, *wrist])
+
+        candidates = self._polish(np.array(candidates), T)
+        candidates = self._within(_wrap(candidates), qlim)
+        if len(candidates) == 0:
+            return candidates
+
+        error = np.abs(self.chain.fkine(candidates) - T).max(axis=(1, 2))
+        return candidates[error < TOLERANCE]
+
+    def _polish(self, Q, T):
+        # newton steps removing the small error due to the nearly ideal
+        # geometry, all candidates at once
+        for _ in range(NEWTON_STEPS):
+            J, Te = self.chain.jacob0(Q)
+            e = np.empty((len(Q), 6))
+            e[:, :3] = T[:3, 3] - Te[:, :3, 3]
+            # small rotation error in the base frame
+            e[:, 3:] = 0.5 * np.cross(Te[:, :3, :3], T[:3, :3], axisa=1, axisb=0, axisc=1).sum(axis=2)
+            Q = Q + (np.linalg.pinv(J, rcond=1e-6) @ e[..., None])[..., 0]
+        return Q
+
+    def _within(self, Q, qlim):
+        # the joint angles are ambiguous by 2pi, all equivalent ones within
+        # the limits are valid solutions.
+        lo, hi = qlim
+        solutions = []
+        for q in Q:
+            options = [
+                [v + k * 2 * np.pi for k in (-1, 0, 1) if lo[j] <= v + k * 2 * np.pi <= hi[j]]
+                for j, v in enumerate(q)
+            ]
+            solutions.extend(itertools.product(*options))
+        return np.array(solutions).reshape(-1, 6)
+
+
+def pose_error(Te, T):
+    """
+    Errors from the poses Te (N, 4, 4) to the pose T in the base frame, or
+    to the poses T (N, 4, 4) row by row: translation and angle-axis
+    rotation, shaped (N, 6).
+    """
+    e = np.empty((len(Te), 6))
+    e[:, :3] = T[..., :3, 3] - Te[:, :3, 3]
+
+    R = T[..., :3, :3] @ Te[:, :3, :3].transpose(0, 2, 1)
+    li = np.stack([
+        R[:, 2, 1] - R[:, 1, 2],
+        R[:, 0, 2] - R[:, 2, 0],
+        R[:, 1, 0] - R[:, 0, 1],
+    ], axis=1)
+    ln = np.linalg.norm(li, axis=1)
+    tr = np.trace(R, axis1=1, axis2=2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        e[:, 3:] = (np.arctan2(ln, tr - 1) / ln)[:, None] * li
+
+    # rotations of 0 or pi, where the axis is not given by li
+    if (small := ln < EPS).any():
+        diag = np.diagonal(R[small], axis1=1, axis2=2)
+        e[small, 3:] = np.where(
+            (tr[small] > 0)[:, None], 0, np.pi / 2 * (diag + 1)
+        )
+    return e
+
+
+def dls(chain, T, seeds, qlim, iterations=DLS_ITERATIONS, tolerance=DLS_TOLERANCE):
+    """
+    Levenberg-Marquardt (damped least squares) from all seeds at once. The
+    damping of each seed adapts: it shrinks after a step reducing the error
+    and grows after a rejected one, so the steps are large far from the
+    goal and near singularities they stay short instead of oscillating.
+    The joints are kept within qlim. T is the goal of all seeds, or one
+    goal (N, 4, 4) per seed.
+
+    Returns the joint angles (N, 6) and whether each seed converged.
+    """
+    lo, hi = qlim
+    T = np.asarray(T)
+    Q = np.clip(np.array(seeds, dtype=float), lo, hi)
+    damping = np.full(len(Q), DLS_DAMPING)
+
+    J, Te = chain.jacob0(Q)
+    e = pose_error(Te, T)
+    E = np.einsum("ni,ni->n", e, e)
+
+    for _ in range(iterations):
+        # the seeds reached the goal, or stuck with no step reducing the error
+        active = np.flatnonzero((E > tolerance ** 2) & (damping < DLS_DAMPING_MAX))
+        if len(active) == 0:
+            break
+
+        Ja, ea = J[active], e[active]
+        Jt = Ja.transpose(0, 2, 1)
+        A = Jt @ Ja + damping[active, None, None] * np.eye(chain.n)
+        dq = np.linalg.solve(A, Jt @ ea[..., None])[..., 0]
+        Qn = np.clip(Q[active] + dq, lo, hi)
+
+        Jn, Ten = chain.jacob0(Qn)
+        en = pose_error(Ten, T if T.ndim == 2 else T[active])
+        En = np.einsum("ni,ni->n", en, en)
+
+        better = En < E[active]
+        i = active[better]
+        Q[i], J[i], e[i], E[i] = Qn[better], Jn[better], en[better], En[better]
+        damping[active] = np.clip(
+            np.where(better, damping[active] / 10, damping[active] * 10),
+            DLS_DAMPING_MIN,
+            DLS_DAMPING_MAX,
+        )
+
+    return Q, E <= tolerance ** 2
+
+
+def closest(solutions, q):
+    """
+    The solution closest to q in the joint space, or None if there is none.
+    """
+    if len(solutions) == 0:
+        return None
+    return solutions[np.argmin(np.linalg.norm(solutions - q, axis=1))]
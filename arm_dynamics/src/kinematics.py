@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class Chain:
+    """
+    Forward kinematics and jacobians of a serial chain of revolute joints,
+    vectorized over a batch of joint configurations.
+
+    The constant transforms are taken from the ETS of the robot, so the
+    results agree with ETS.fkine and ETS.jacob0/jacobe.
+    """
+
+    def __init__(self, ets):
+        statics = []
+        axes = []
+        current = np.eye(4)
+
+        for et in ets:
+            if not et.isjoint:
+                current = current @ et.A()
+                continue
+
+            if et.axis not in ("Rx", "Ry", "Rz") or et.jindex != len(axes):
+                raise ValueError(f"unsupported joint {et}")
+
+            axis = np.zeros(3)
+            axis["xyz".index(et.axis[1])] = -1 if et.isflip else 1
+            axes.append(axis)
+            statics.append(current)
+            current = np.eye(4)
+
+        # statics[i] is the constant transform right before joint i, and
+        # tool is the one after the last joint
+        self.statics = np.array(statics)
+        self.axes = np.array(axes)
+        self.tool = current
+        self.n = len(axes)
+
+        # cross-product matrices of the axes, for Rodrigues' formula
+        self._k = np.array([
+            [[0, -z, y], [z, 0, -x], [-y, x, 0]] for x, y, z in axes
+        ]).reshape(-1, 3, 3)
+        self._kk = self._k @ self._k
+
+    def _rotations(self, j, q):
+        # rotations of joint j by the angles q
+        s = np.sin(q)[:, None, None]
+        c = np.cos(q)[:, None, None]
+        R = np.zeros((len(q), 4, 4))
+        R[:, :3, :3] = s * self._k[j] + (1 - c) * self._kk[j]
+        R[:, [0, 1, 2, 3], [0, 1, 2, 3]] += 1
+        return R
+
+    def frames(self, Q):
+        """
+        Returns the frames of all joints (before rotating the joint), shaped
+        (N, n, 4, 4), and the end-effector poses, shaped (N, 4, 4).
+        """
+        Q = np.atleast_2d(Q)
+        T = np.empty((len(Q), 4, 4))
+        T[:] = np.eye(4)
+        joints = np.empty((len(Q), self.n, 4, 4))
+
+        for j in range(self.n):
+            T = T @ self.statics[j]
+            joints[:, j] = T
+            T = T @ self._rotations(j, Q[:, j])
+
+        return joints, T @ self.tool
+
+    def fkine(self, Q):
+        return self.frames(Q)[1]
+
+    def jacob0(self, Q):
+        """
+        Geometric jacobians in the base frame, shaped (N, 6, n)
+        """
+        joints, Te = self.frames(Q)
+        z = np.einsum("njab,jb->nja", joints[:, :, :3, :3], self.axes)
+        p = joints[:, :, :3, 3]
+        pe = Te[:, None, :3, 3]
+        J = np.concatenate([np.cross(z, pe - p), z], axis=2)
+        return J.transpose(0, 2, 1), Te
+
+    def jacobe(self, Q):
+        """
+        Geometric jacobians in the end-effector frame, shaped (N, 6, n)
+        """
+        J0, Te = self.jacob0(Q)
+        Rt = Te[:, :3, :3].transpose(0, 2, 1)
+        return np.concatenate([Rt @ J0[:, :3], Rt @ J0[:, 3:]], axis=1), Te
+
+
+def inv(T):
+    # inverse of a batch of rigid transforms
+    Rt = T[:, :3, :3].transpose(0, 2, 1)
+    Ti = np.empty_like(T)
+    Ti[:] = np.eye(4)
+    Ti[:, :3, :3] = Rt
+    Ti[:, :3, 3] = -(Rt @ T[:, :3, 3, None])[..., 0]
+    return Ti
+
+
+def trans(offsets):
+    T = np.empty((len(offsets), 4, 4))
+    T[:] = np.eye(4)
+    T[:, :3, 3] = offsets
+    return T
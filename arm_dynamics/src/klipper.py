@@ -0,0 +1,62 @@
+import os
+import configparser
+
+import numpy as np
+
+KLIPPER_CONFIG = os.environ.get(
+    "KLIPPER_CONFIG",
+    os.path.join(os.path.split(__file__)[0], "../../klipper/parol6_octpus.cfg"),
+)
+# the steppers driving the joints J1 ~ J6
+STEPPERS = [f"stepper_{n}" for n in "xyzabc"]
+
+# sign because of the direction is different between the real
+# hardware and the urdf (TODO fixup the urdf)
+REDUCTION_RATIOS = [-6, -20, 20, -4, -4, -10]
+# FIXUP on axis-Z because of the difference of point 0
+FIXUP = [0, 0, 0, 0, 0, 0]
+
+
+def to_model(q):
+    # klipper positions -> joint angles of the urdf model
+    return [v / r + p for v, r, p in zip(q, REDUCTION_RATIOS, FIXUP)]
+
+
+def from_model(q):
+    # joint angles of the urdf model -> klipper positions
+    return [(v - p) * r for v, r, p in zip(q, REDUCTION_RATIOS, FIXUP)]
+
+
+def read_config(path=KLIPPER_CONFIG):
+    # klipper's config is mostly ini, with ':' as delimiter and '#' comments
+    parser = configparser.ConfigParser(
+        inline_comment_prefixes=("#",),
+        interpolation=None,
+        strict=False,
+    )
+    if not parser.read(path):
+        raise FileNotFoundError(path)
+    return parser
+
+
+def joint_limits(path=KLIPPER_CONFIG):
+    """
+    The position_min/position_max of the steppers, converted to the joint
+    angles of the urdf model. Returns an array of shape (2, 6) like
+    Robot.qlim.
+    """
+    config = read_config(path)
+    lo = to_model([config.getfloat(s, "position_min") for s in STEPPERS])
+    hi = to_model([config.getfloat(s, "position_max") for s in STEPPERS])
+    # the sign of the reduction ratio may swap the two ends
+    return np.array([np.minimum(lo, hi), np.maximum(lo, hi)])
+
+
+def units_per_rad(config):
+    """
+    The klipper's units of each stepper per rad of its joint. As gear_ratio
+    is given, rotation_distance is the travel for a turn of the final gear.
+    """
+    return np.array([
+        config.getfloat(s, "rotation_distance") / (2 * np.pi) for s in STEPPERS
+    ])
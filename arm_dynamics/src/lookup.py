@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+ROTATION_SCALE = 0.1
+
+
+def features(T):
+    T = np.asarray(T).reshape(-1, 4, 4)
+    return np.hstack([
+        T[:, :3, 3],
+        T[:, :3, 0] * ROTATION_SCALE,
+        T[:, :3, 1] * ROTATION_SCALE,
+    ])
+
+
+class Lookup:
+    """
+    Sampled joint angles and the resulting end-effector poses, for
+    warm-starting the numerical IK with the samples nearest to a target.
+
+    Each row of the table holds 6 joint angles followed by the features of
+    the pose: the position and the first two columns of the rotation scaled
+    by ROTATION_SCALE, so that 1 rad weighs about as much as 0.1 m.
+    """
+
+    def __init__(self, path):
+        # memory-mapped, the joints are paged in on demand and shared by the
+        # processes loading the same file. The tree copies the features into
+        # the heap of each process.
+        self.table = np.load(path, mmap_mode="r")
+        self.joints = self.table[:, :6]
+        self.tree = cKDTree(self.table[:, 6:])
+
+    def __len__(self):
+        return len(self.table)
+
+    def seeds(self, T, k):
+        """
+        The joint angles of the k samples nearest to the pose T
+        """
+        _, index = self.tree.query(features(T)[0], k=min(k, len(self)))
+        return np.array(self.joints[np.atleast_1d(index)], dtype=float)
+
+
+def build(chain, qlim, samples, rng, chunk=10000):
+    table = np.empty((samples, 15), dtype=np.float32)
+    for begin in range(0, samples, chunk):
+        Q = rng.uniform(*qlim, size=(min(chunk, samples - begin), 6))
+        table[begin:begin + len(Q), :6] = Q
+        table[begin:begin + len(Q), 6:] = features(chain.fkine(Q))
+    return table
+
+
+def main():
+    import model
+
+    parser = argparse.ArgumentParser(
+        prog="lookup",
+        description="sample the joint space within the limits and save the IK lookup table",
+    )
+    parser.add_argument("-n", "--samples", type=int, default=200000)
+    parser.add_argument("-o", "--output", default="lookup.npy")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    parol6 = model.load()
+    begin = time.time()
+    table = build(parol6.chain, parol6.qlim, args.samples, np.random.default_rng(args.seed))
+    np.save(args.output, table)
+    print(f"{args.samples} samples saved to {args.output} in {time.time() - begin:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
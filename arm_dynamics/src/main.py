@@ -1,16 +1,42 @@
 import os
+import time
+import threading
+from contextlib import asynccontextmanager
 from typing import List, Tuple, Optional
 
-from pydantic import BaseModel
-from fastapi import FastAPI
+from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import roboticstoolbox as rtb
-import spatialmath as sm
-import numpy as np
 
+import cache
+import events
+import model
+import pool
+import scheduler
+import trajectory
 import utils
 
-app = FastAPI()
+# planning runs in PLANNER_WORKERS processes (0 for the threadpool of the
+# server), and at most PLANNER_QUEUE requests are accepted at a time
+PLANNER_WORKERS = int(os.environ.get("PLANNER_WORKERS", 2))
+PLANNER_QUEUE = int(os.environ.get("PLANNER_QUEUE", 16))
+planning = pool.PlanningPool(PLANNER_WORKERS, PLANNER_QUEUE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # parse the urdf before serving, rather than in the first request
+    model.load()
+    await planning.start()
+    await utils.link.start()
+    await motion.start()
+    yield
+    await motion.stop()
+    await utils.link.stop()
+    planning.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -28,19 +54,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def from_urdf(file_path, tld=None, xacro_tld=None):
-    links, name, urdf_string, urdf_filepath = rtb.Robot.URDF_read(
-        file_path, tld=tld, xacro_tld=xacro_tld
-    )
-
-    return rtb.Robot(
-        links,
-        name=name,
-        urdf_string=urdf_string,
-        urdf_filepath=urdf_filepath,
-    )
-
-
 class ShiftRequest(BaseModel):
     q: List[float]
     offset: Tuple[float, float, float]
@@ -51,50 +64,242 @@ class ShiftResponse(BaseModel):
     arrived: bool
 
 
-PACKAGE_DIR = os.path.split(__file__)[0]
-# sign because of the direction is different between the real
-# hardware and the urdf (TODO fixup the urdf)
-REDUCTION_RATIOS = [-6, -20, 20, -4, -4, -10]
-# FIXUP on axis-Z because of the difference of point 0
-FIXUP = [0, 0, 0, 0, 0, 0]
+class PlanTiming:
+    def __init__(self):
+        self.first = None
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            if self.first is None:
+                self.first = seconds
+                print(f"first plan took {seconds * 1000:.1f}ms")
+            else:
+                self.count += 1
+                self.total += seconds
+
+    def report(self):
+        return {
+            "first_seconds": self.first,
+            "count": self.count,
+            "mean_seconds": self.total / self.count if self.count else None,
+        }
+
+
+plan_timing = PlanTiming()
+
+# jogging repeats the same small offset from nearly the same joints. The
+# tolerances are in klipper's units for the joints, and in m for the offset.
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", 1024))
+PLAN_CACHE_Q_TOLERANCE = float(os.environ.get("PLAN_CACHE_Q_TOLERANCE", 0.01))
+PLAN_CACHE_OFFSET_TOLERANCE = float(os.environ.get("PLAN_CACHE_OFFSET_TOLERANCE", 0.0005))
+plan_cache = cache.PlanCache(
+    PLAN_CACHE_SIZE,
+    PLAN_CACHE_Q_TOLERANCE,
+    PLAN_CACHE_OFFSET_TOLERANCE,
+)
 
 
 @app.post("/plan")
-def read_item(shift: ShiftRequest):
-    parol6 = from_urdf("urdf/PAROL6.urdf.xacro", tld=PACKAGE_DIR, xacro_tld=PACKAGE_DIR)
+async def read_item(shift: ShiftRequest):
+    begin = time.perf_counter()
+    key = plan_cache.key(shift.q, shift.offset)
+
+    if (response := plan_cache.get(key)) is None:
+        path, arrived = await planning.run(pool.plan, shift.q, shift.offset)
+        response = ShiftResponse(path=path, arrived=arrived)
+        plan_cache.put(key, response)
 
-    path = []
-    arrived = False
+    plan_timing.record(time.perf_counter() - begin)
+    return response
 
-    q = [v / r + p for v, r, p in zip(shift.q, REDUCTION_RATIOS, FIXUP)]
-    Tep = parol6.fkine(q) * sm.SE3.Trans(*shift.offset)
 
-    while not arrived and len(path) < 10:
-        v, arrived = rtb.p_servo(parol6.fkine(q), Tep, 1, threshold=0.2)
-        qd = np.linalg.pinv(parol6.jacobe(q)) @ v
-        norm = np.linalg.norm(qd, 2)
-        if norm > 1:
-            qd /= norm
-        q = q + qd * 0.5
-        path.append(q)
+@app.post("/plan/batch")
+async def plan_batch(shifts: List[ShiftRequest]) -> List[ShiftResponse]:
+    if not shifts:
+        return []
+
+    paths, arrived = await planning.run(
+        pool.plan_batch, [s.q for s in shifts], [s.offset for s in shifts]
+    )
 
-    def _revert(q):
-        return [(v - p) * r for v, r, p in zip(q, REDUCTION_RATIOS, FIXUP)]
+    return [
+        ShiftResponse(path=path, arrived=a)
+        for path, a in zip(paths, arrived)
+    ]
 
-    path = [_revert(q) for q in path]
 
+@app.post("/plan/ik")
+async def plan_ik(shift: ShiftRequest):
+    path, arrived = await planning.run(pool.plan_ik, shift.q, shift.offset)
     return ShiftResponse(path=path, arrived=arrived)
 
 
+@app.get("/stats")
+def stats():
+    return {
+        "model_load_seconds": model.load().load_seconds,
+        "plan": plan_timing.report(),
+        "cache": plan_cache.report(),
+        "pool": planning.report(),
+        "execute": execution_timing.report(),
+        "connection": utils.link.report(),
+        "scheduler": motion.report(),
+        "latency": events.report(),
+    }
+
+
 class Step(BaseModel):
     gripper: Optional[float] = None
     positions: Optional[List[float]] = None
+    # in klipper's units per min
+    feedrate: Optional[float] = None
 
 
 class PlanRequest(BaseModel):
     path: List[Step]
 
 
+class TrajectoryRequest(BaseModel):
+    q: List[float]
+    path: List[List[float]]
+    speed: float = Field(default=1.0, gt=0, le=1)
+
+
+class TrajectoryResponse(BaseModel):
+    path: List[Step]
+    duration: float
+
+
+@app.post("/trajectory")
+def plan_trajectory(request: TrajectoryRequest):
+    """
+    Time-parameterize a path from /plan, starting at q, within the limits
+    of the steppers in klipper's config. The steps carry their feedrates
+    and can be sent to /execute.
+    """
+    moves = trajectory.parameterize(
+        request.q, request.path, trajectory.load(), request.speed
+    )
+    return TrajectoryResponse(
+        path=[Step(positions=m.positions, feedrate=m.feedrate) for m in moves],
+        duration=sum(m.duration for m in moves),
+    )
+
+
+class ExecutionTiming:
+    """
+    The time taken by /execute, per step, with and without pipelining
+    """
+
+    def __init__(self):
+        self.steps = {True: 0, False: 0}
+        self.seconds = {True: 0.0, False: 0.0}
+
+    def record(self, pipelined, steps, seconds):
+        self.steps[pipelined] += steps
+        self.seconds[pipelined] += seconds
+
+    def per_step(self, pipelined):
+        if steps := self.steps[pipelined]:
+            return self.seconds[pipelined] / steps
+        return None
+
+    def report(self):
+        # of whatever paths were run each way, not comparable step by step
+        return {
+            "pipelined_seconds_per_step": self.per_step(True),
+            "blocking_seconds_per_step": self.per_step(False),
+        }
+
+
+execution_timing = ExecutionTiming()
+
+
+async def _execute(path, pipelined):
+    seconds = await utils.execute(path, pipelined, EXECUTE_CHUNK)
+    execution_timing.record(pipelined, len(path), seconds)
+    return seconds
+
+
+# all the paths to execute go through one queue, see scheduler.POLICIES
+EXECUTE_POLICY = os.environ.get("EXECUTE_POLICY", "fifo")
+EXECUTE_QUEUE = int(os.environ.get("EXECUTE_QUEUE", 32))
+# pipelined, the gcodes are sent in scripts of up to EXECUTE_CHUNK
+EXECUTE_CHUNK = int(os.environ.get("EXECUTE_CHUNK", 10))
+motion = scheduler.Scheduler(_execute, EXECUTE_POLICY, EXECUTE_QUEUE)
+
+
 @app.post("/execute")
-async def execute(plan: PlanRequest):
-    await utils.execute(plan.path)
+async def execute(plan: PlanRequest, pipelined: bool = True):
+    """
+    With pipelined (the default), the moves are queued in klipper without
+    waiting for them, a script of several at a time, so that they are
+    blended, and it waits only before the gripper acts. Otherwise each move is waited for before sending the
+    next one. The progress is published to mqtt, see events.Progress.
+
+    Returns when the path is done, or dropped by the scheduler.
+    """
+    result = await motion.submit(plan.path, pipelined)
+    return {**result, "pipelined": pipelined}
+
+
+@app.get("/execute/queue")
+def execute_queue():
+    return motion.report()
+
+
+@app.delete("/execute/queue")
+def cancel_queue():
+    return {"cancelled": motion.cancel()}
+
+
+class StreamRequest(ShiftRequest):
+    # move the arm along the waypoints while they are being planned
+    execute: bool = False
+
+
+async def _stream(websocket: WebSocket, shift: StreamRequest):
+    # solved as /plan, in the planning pool, before anything is sent
+    path, arrived = await planning.run(pool.plan, shift.q, shift.offset)
+    for index, positions in enumerate(path):
+        await websocket.send_json({"index": index, "positions": positions})
+    await websocket.send_json({"arrived": arrived})
+
+    # a path short of the goal is not executed
+    if not (shift.execute and arrived):
+        return
+
+    async with motion.motion, utils.connect() as rpc:
+        for index, positions in enumerate(path):
+            await utils.run_step(rpc, Step(positions=positions), sync=False)
+            await websocket.send_json({"executed": index})
+        # the last move is done
+        await utils.run_gcode(rpc, "M400", sync=False)
+
+
+@app.websocket("/plan/stream")
+async def plan_stream(websocket: WebSocket):
+    """
+    Takes a StreamRequest per message, solved as /plan, and answers with
+    the waypoints: {"index", "positions"} for each one, then {"arrived"}.
+    The path is planned in full before the first waypoint, so planning does
+    not overlap the execution. With execute, a path that arrived is then
+    sent to the arm, and {"executed": index} follows when klipper has queued
+    each waypoint, without waiting for the previous moves to finish. A path
+    that did not arrive is never executed. When the planning pool is full,
+    the answer is {"error"} instead.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            shift = StreamRequest.model_validate(await websocket.receive_json())
+            try:
+                await _stream(websocket, shift)
+            except HTTPException as e:
+                # the planning pool is full
+                await websocket.send_json({"error": e.detail})
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import roboticstoolbox as rtb
+
+import klipper
+from ik import AnalyticIK
+from kinematics import Chain
+from lookup import Lookup
+
+PACKAGE_DIR = os.path.split(__file__)[0]
+URDF_FILE = "urdf/PAROL6.urdf.xacro"
+# built offline with lookup.py
+IK_LOOKUP = os.environ.get("IK_LOOKUP", os.path.join(PACKAGE_DIR, "lookup.npy"))
+
+
+def from_urdf(file_path, tld=None, xacro_tld=None):
+    links, name, urdf_string, urdf_filepath = rtb.Robot.URDF_read(
+        file_path, tld=tld, xacro_tld=xacro_tld
+    )
+
+    return rtb.Robot(
+        links,
+        name=name,
+        urdf_string=urdf_string,
+        urdf_filepath=urdf_filepath,
+    )
+
+
+@dataclass(frozen=True)
+class Model:
+    robot: rtb.Robot
+    # the elementary transforms from the base to the end-effector. Robot.fkine
+    # and Robot.jacobe walk the link tree and rebuild it on every call, while
+    # the ETS keeps the constant link transforms evaluated once.
+    ets: rtb.ETS
+    # the same chain, for planning many configurations at once
+    chain: Chain
+    ik: AnalyticIK
+    # joint limits of the hardware, or of the urdf if klipper's config is
+    # not available
+    qlim: np.ndarray
+    # samples of the workspace for warm-starting the IK, if available
+    lookup: Optional[Lookup]
+    load_seconds: float
+
+
+def _joint_limits(robot):
+    try:
+        return klipper.joint_limits()
+    except FileNotFoundError as e:
+        print(f"klipper config {e} not found, using the joint limits of the urdf")
+        return robot.qlim
+
+
+def _lookup():
+    if not os.path.exists(IK_LOOKUP):
+        print(f"IK lookup table {IK_LOOKUP} not found, planning without warm start")
+        return None
+    return Lookup(IK_LOOKUP)
+
+
+_lock = threading.Lock()
+_models = {}
+
+
+def load(file_path=URDF_FILE) -> Model:
+    """
+    Parse the urdf and build the robot once per process. The model is
+    never mutated afterwards, so it is safe to share it between the
+    threads serving the requests.
+    """
+    if (model := _models.get(file_path)) is not None:
+        return model
+
+    with _lock:
+        if (model := _models.get(file_path)) is not None:
+            return model
+
+        begin = time.perf_counter()
+        robot = from_urdf(file_path, tld=PACKAGE_DIR, xacro_tld=PACKAGE_DIR)
+        ets = robot.ets()
+        chain = Chain(ets)
+        model = Model(
+            robot=robot,
+            ets=ets,
+            chain=chain,
+            ik=AnalyticIK(chain),
+            qlim=_joint_limits(robot),
+            lookup=_lookup(),
+            load_seconds=time.perf_counter() - begin,
+        )
+        print(f"model {robot.name} loaded in {model.load_seconds * 1000:.1f}ms")
+        _models[file_path] = model
+        return model
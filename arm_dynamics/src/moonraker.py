@@ -0,0 +1,77 @@
+import json
+import asyncio
+import itertools
+from collections import defaultdict
+
+
+class RpcError(Exception):
+    def __init__(self, error):
+        super().__init__(error.get("message"))
+        self.code = error.get("code")
+
+
+class Client:
+    """
+    JSON-RPC client over a websocket to moonraker. Any number of calls can
+    be in flight at once: each gets its own id, and the dispatcher resolves
+    the future of the call when its reply arrives. The notifications, like
+    notify_status_update, are passed to the callbacks subscribed to them.
+    """
+
+    def __init__(self, ws, callbacks=None):
+        self.ws = ws
+        self.ids = itertools.count(1)
+        self.pending = {}
+        # method -> callbacks taking the params of the notification
+        self.callbacks = callbacks if callbacks is not None else defaultdict(list)
+
+    async def call(self, method, params=None):
+        id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[id] = future
+
+        message = {"jsonrpc": "2.0", "method": method, "id": id}
+        if params is not None:
+            message["params"] = params
+
+        try:
+            await self.ws.send(json.dumps(message))
+            return await future
+        finally:
+            self.pending.pop(id, None)
+
+    def subscribe(self, method, callback):
+        self.callbacks[method].append(callback)
+
+    def unsubscribe(self, method, callback):
+        self.callbacks[method].remove(callback)
+
+    async def dispatch(self):
+        """
+        Reads the socket until it is closed, then fails the calls still
+        waiting for their replies and raises ConnectionError.
+        """
+        try:
+            async for message in self.ws:
+                self._handle(json.loads(message))
+            raise ConnectionError("moonraker disconnected")
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("moonraker disconnected"))
+
+    def _handle(self, message):
+        if (future := self.pending.get(message.get("id"))) is not None:
+            if future.done():
+                return
+            if "error" in message:
+                future.set_exception(RpcError(message["error"]))
+            else:
+                future.set_result(message.get("result"))
+            return
+
+        for callback in list(self.callbacks.get(message.get("method"), [])):
+            try:
+                callback(*message.get("params", []))
+            except Exception as e:
+                print(f"callback of {message['method']} failed: {e!r}")
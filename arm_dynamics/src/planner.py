@@ -0,0 +1,86 @@
+import numpy as np
+
+import ik
+import kinematics
+
+# the numerical solver starts from the current joints and some random seeds
+SEEDS = 8
+# the nearest samples from the lookup table, tried with the random seeds
+LOOKUP_SEEDS = 4
+# the largest move of the joints (in rad) between two waypoints
+MAX_JOINT_STEP = 0.5
+
+
+def analytic(model, q, offset):
+    """
+    The same goal as solve, reached in one step with the analytic solution
+    closest to q. The path is empty if no solution within the joint limits
+    exists.
+    """
+    q = np.asarray(q, dtype=float)
+    Tep = model.chain.fkine(q)[0] @ kinematics.trans([offset])[0]
+    solutions = model.ik.solve(Tep, model.qlim, hint=q)
+
+    if (best := ik.closest(solutions, q)) is None:
+        return [], False
+    return [best], True
+
+
+def interpolate(q0, q1, max_step=MAX_JOINT_STEP):
+    """
+    The straight path in the joint space from q0 to q1 (exclusive q0), in
+    steps no larger than max_step. It respects the joint limits if both
+    ends do.
+    """
+    q0, q1 = np.asarray(q0), np.asarray(q1)
+    steps = max(1, int(np.ceil(np.linalg.norm(q1 - q0) / max_step)))
+    return [q0 + (q1 - q0) * (i / steps) for i in range(1, steps + 1)]
+
+
+def solve(model, q, offset, seeds=SEEDS):
+    """
+    Plan a path moving the end-effector by offset (in its own frame),
+    starting from the joint angles q, with damped least squares. The current
+    joints are tried alone first, so that a small move stays on the same
+    branch of the IK. If they fail, the nearest samples from the lookup
+    table and random seeds within the joint limits are searched in
+    parallel. Among the converged seeds the one closest to q wins,
+    otherwise the best effort from q is returned and arrived is False.
+    """
+    paths, arrived = solve_batch(model, [q], [offset], seeds)
+    return paths[0], arrived[0]
+
+
+def solve_batch(model, qs, offsets, seeds=SEEDS):
+    """
+    solve for each of the joint angles qs and offsets, with the seeds of all
+    of them in the same DLS. Returns the paths and whether each arrived.
+    """
+    qs = np.asarray(qs, dtype=float)
+    Tep = model.chain.fkine(qs) @ kinematics.trans(offsets)
+
+    # the best effort from the current joints, not a far random seed
+    goals, converged = ik.dls(model.chain, Tep, qs, model.qlim)
+
+    failed = np.flatnonzero(~converged)
+    if len(failed):
+        Q0, owner = [], []
+        for i in failed:
+            # the same seeds as for a single shift
+            rng = np.random.default_rng(0)
+            Qi = rng.uniform(*model.qlim, size=(seeds, qs.shape[1]))
+            if model.lookup is not None:
+                Qi = np.vstack([model.lookup.seeds(Tep[i], LOOKUP_SEEDS), Qi])
+            Q0.append(Qi)
+            owner.append(np.full(len(Qi), i))
+        Q0, owner = np.vstack(Q0), np.concatenate(owner)
+
+        Q, cr = ik.dls(model.chain, Tep[owner], Q0, model.qlim)
+        for i in failed:
+            mine = cr & (owner == i)
+            if mine.any():
+                goals[i] = ik.closest(Q[mine], qs[i])
+                converged[i] = True
+
+    paths = [interpolate(q, goal) for q, goal in zip(qs, goals)]
+    return paths, [bool(c) for c in converged]
@@ -0,0 +1,99 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+
+import klipper
+import model
+import planner
+
+
+# the jobs run in the workers, taking and returning klipper's positions
+
+def ready():
+    model.load()
+
+
+def plan(q, offset):
+    path, arrived = planner.solve(model.load(), klipper.to_model(q), offset)
+    return [klipper.from_model(q) for q in path], arrived
+
+
+def plan_batch(qs, offsets):
+    # one job for the batch, the shifts solved together but as by plan
+    paths, arrived = planner.solve_batch(
+        model.load(), [klipper.to_model(q) for q in qs], offsets
+    )
+    return [[klipper.from_model(q) for q in path] for path in paths], arrived
+
+
+def plan_ik(q, offset):
+    path, arrived = planner.analytic(model.load(), klipper.to_model(q), offset)
+    return [klipper.from_model(q) for q in path], arrived
+
+
+class PlanningPool:
+    """
+    Runs the planning jobs in worker processes, each with its own model
+    loaded at start, so that planning scales with the cores and does not
+    hold the GIL of the server. With 0 workers, the jobs run in the
+    threadpool of the server instead.
+
+    At most max_pending jobs are accepted (running or waiting), further
+    ones are rejected with 429.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.executor = None
+
+        if workers > 0:
+            # spawn rather than fork the server, which has threads running
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=ready,
+            )
+
+    async def start(self):
+        # start all the workers, loading their models, before serving
+        if self.executor:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[
+                loop.run_in_executor(self.executor, ready)
+                for _ in range(self.workers)
+            ])
+
+    async def run(self, job, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="too many planning requests")
+
+        self.pending += 1
+        self.submitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, job, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    def report(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+        }
@@ -0,0 +1,152 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+
+# fifo: the paths run one after another in the order they come
+# coalesce: the same, but the pending paths are joined and run at once
+# latest: a new path cancels the pending ones and stops the running one
+POLICIES = ("fifo", "coalesce", "latest")
+
+
+@dataclass
+class Job:
+    path: list
+    pipelined: bool
+    future: asyncio.Future
+
+
+class Scheduler:
+    """
+    The single queue of the paths to execute on the arm. A background task
+    takes the jobs from the queue and runs them with execute(path,
+    pipelined), one at a time, and each submitter gets the outcome of its
+    own job: {"status": "done", "seconds"}, or "cancelled" if it was
+    dropped before running, or "preempted" if it was stopped while running.
+
+    A running job stops between its steps, the moves already queued in
+    klipper are not taken back.
+    """
+
+    def __init__(self, execute, policy, max_pending):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy}, expecting one of {POLICIES}")
+
+        self.execute = execute
+        self.policy = policy
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.wakeup = asyncio.Event()
+        # held while a job runs, or by anyone else moving the arm
+        self.motion = asyncio.Lock()
+        self.running = None
+        self.task = None
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.preempted = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.cancel()
+        if self.running:
+            self.running.cancel()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def submit(self, path, pipelined):
+        """
+        Queues the path, returning the future of its outcome
+        """
+        if self.policy == "latest":
+            self.cancel()
+            if self.running:
+                self.running.cancel()
+
+        if len(self.pending) >= self.max_pending:
+            raise HTTPException(status_code=429, detail="too many paths to execute")
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(Job(path, pipelined, future))
+        self.submitted += 1
+        self.wakeup.set()
+        return future
+
+    def cancel(self):
+        """
+        Drops the pending jobs, returning how many
+        """
+        count = len(self.pending)
+        while self.pending:
+            self._finish([self.pending.popleft()], {"status": "cancelled"})
+        self.cancelled += count
+        return count
+
+    def _finish(self, jobs, result=None, error=None):
+        for job in jobs:
+            if job.future.done():
+                continue
+            if error:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def _next(self):
+        jobs = [self.pending.popleft()]
+        if self.policy == "coalesce":
+            while self.pending and self.pending[0].pipelined == jobs[0].pipelined:
+                jobs.append(self.pending.popleft())
+            self.coalesced += len(jobs) - 1
+        return jobs
+
+    async def _run(self):
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            async with self.motion:
+                # the queue may have been cancelled while waiting for the arm
+                if not self.pending:
+                    continue
+
+                jobs = self._next()
+                path = [s for job in jobs for s in job.path]
+                self.running = asyncio.create_task(self.execute(path, jobs[0].pipelined))
+                try:
+                    await asyncio.wait([self.running])
+                finally:
+                    running, self.running = self.running, None
+
+            if running.cancelled():
+                self.preempted += len(jobs)
+                self._finish(jobs, {"status": "preempted"})
+            elif (error := running.exception()) is not None:
+                self.failed += len(jobs)
+                self._finish(jobs, error=error)
+            else:
+                self.completed += len(jobs)
+                self._finish(jobs, {"status": "done", "seconds": running.result()})
+
+    def report(self):
+        return {
+            "policy": self.policy,
+            "depth": len(self.pending),
+            "max_pending": self.max_pending,
+            "running": self.running is not None,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "preempted": self.preempted,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+        }
@@ -0,0 +1,139 @@
+import os
+import functools
+from dataclasses import dataclass
+
+import numpy as np
+
+import klipper
+
+# the velocity limit of the joints in the urdf, in rad/s
+JOINT_VELOCITY = float(os.environ.get("JOINT_VELOCITY", 1.57))
+# klipper's default, when the config does not set it
+SQUARE_CORNER_VELOCITY = 5.0
+# segments shorter than this (in klipper's units) are dropped
+MIN_DISTANCE = 1e-6
+
+
+@dataclass(frozen=True)
+class Limits:
+    # per axis, in klipper's units per s and per s^2
+    velocity: np.ndarray
+    accel: np.ndarray
+    # of the whole move, as klipper limits the move vector
+    max_velocity: float
+    max_accel: float
+    junction_deviation: float
+
+
+@dataclass(frozen=True)
+class Move:
+    positions: list
+    # in klipper's units per min, for the F of G1
+    feedrate: float
+    entry_velocity: float
+    exit_velocity: float
+    duration: float
+
+
+def from_config(config):
+    printer = config["printer"]
+    max_velocity = printer.getfloat("max_velocity")
+    max_accel = printer.getfloat("max_accel")
+    square_corner_velocity = printer.getfloat(
+        "square_corner_velocity", SQUARE_CORNER_VELOCITY
+    )
+
+    # a joint turning at JOINT_VELOCITY moves its stepper by this many
+    # units per s, depending on the gear ratio and rotation distance
+    velocity = np.abs(klipper.units_per_rad(config)) * JOINT_VELOCITY
+
+    return Limits(
+        velocity=np.minimum(velocity, max_velocity),
+        accel=np.full(len(klipper.STEPPERS), max_accel),
+        max_velocity=max_velocity,
+        max_accel=max_accel,
+        # the same as klipper's toolhead
+        junction_deviation=square_corner_velocity**2 * (np.sqrt(2) - 1) / max_accel,
+    )
+
+
+@functools.cache
+def load(path=klipper.KLIPPER_CONFIG):
+    return from_config(klipper.read_config(path))
+
+
+def _junctions(u, velocity, accel, junction_deviation):
+    # the largest squared velocity at the corners between the segments,
+    # with klipper's junction deviation model
+    cos_theta = np.clip(-np.sum(u[:-1] * u[1:], axis=1), -1, 1)
+    sin_half = np.sqrt(0.5 * (1 - cos_theta))
+
+    with np.errstate(divide="ignore"):
+        r = sin_half / (1 - sin_half)
+    corner = junction_deviation * r * np.minimum(accel[:-1], accel[1:])
+    corner[cos_theta > 0.999999] = 0
+    corner[cos_theta < -0.999999] = np.inf
+
+    return np.minimum(corner, np.minimum(velocity[:-1], velocity[1:]) ** 2)
+
+
+def _duration(length, v0, v1, cruise, accel):
+    # trapezoidal profile, cruising at the peak if it is reachable
+    peak = np.sqrt(np.minimum(cruise**2, accel * length + (v0**2 + v1**2) / 2))
+    ramps = (2 * peak**2 - v0**2 - v1**2) / (2 * accel)
+    return (2 * peak - v0 - v1) / accel + (length - ramps) / peak
+
+
+def parameterize(start, path, limits, speed=1.0):
+    """
+    Time-parameterize the path (in klipper's units) starting from start, so
+    that no axis exceeds its velocity and acceleration limits, and the moves
+    blend into each other at the corners instead of stopping. The arm is at
+    rest at both ends. speed scales the velocities down.
+
+    Returns the moves with the feedrate to send, and the profile expected
+    from klipper's lookahead.
+    """
+    if len(path) == 0:
+        return []
+
+    P = np.vstack([np.asarray(start, dtype=float), np.asarray(path, dtype=float)])
+    D = np.diff(P, axis=0)
+    L = np.linalg.norm(D, axis=1)
+
+    keep = L > MIN_DISTANCE
+    P, D, L = P[1:][keep], D[keep], L[keep]
+    if len(L) == 0:
+        return []
+
+    u = D / L[:, None]
+    with np.errstate(divide="ignore"):
+        a = np.abs(u)
+        velocity = np.min(limits.velocity / a, axis=1) * speed
+        accel = np.min(limits.accel / a, axis=1)
+    velocity = np.minimum(velocity, limits.max_velocity * speed)
+    accel = np.minimum(accel, limits.max_accel)
+
+    # squared velocities at the start of each segment, and at the end
+    v2 = np.zeros(len(L) + 1)
+    v2[1:-1] = _junctions(u, velocity, accel, limits.junction_deviation)
+
+    # able to stop at the end, then reachable from the start
+    for i in reversed(range(len(L))):
+        v2[i] = min(v2[i], v2[i + 1] + 2 * accel[i] * L[i])
+    for i in range(len(L)):
+        v2[i + 1] = min(v2[i + 1], v2[i] + 2 * accel[i] * L[i])
+
+    v = np.sqrt(v2)
+    duration = _duration(L, v[:-1], v[1:], velocity, accel)
+
+    return [
+        Move(
+            positions=p.tolist(),
+            feedrate=float(f * 60),
+            entry_velocity=float(v0),
+            exit_velocity=float(v1),
+            duration=float(t),
+        )
+        for p, f, v0, v1, t in zip(P, velocity, v[:-1], v[1:], duration)
+    ]
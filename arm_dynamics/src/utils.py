@@ -1,46 +1,95 @@
-import os
-import json
-import asyncio
+import time
+from contextlib import asynccontextmanager
 
-import aiomqtt
-from websockets.asyncio.client import connect as ws_connect
+import connection
+import events
 
+# shared by all the requests, started with the app
+link = connection.Connection()
 
-MQTT_BROKER_URL = os.environ["MQTT_BROKER_URL"]
-MQTT_BROKER_PORT = int(os.environ.get("MQTT_BROKER_PORT", 1883))
-MOONRAKER_URL = os.environ["MOONRAKER_URL"]
 
+async def run_gcode(rpc, gcode, sync=True):
+    # with sync, the reply comes when the moves are done, otherwise as soon
+    # as klipper has queued them, keeping its lookahead busy
+    return await rpc.call(
+        "printer.gcode.script",
+        {"script": gcode + "\nM400" if sync else gcode},
+    )
+
+
+@asynccontextmanager
+async def connect():
+    # the calls are told apart by their ids, so the client is shared as is
+    yield await link.client()
 
-async def run_gcode(ws, gcode):
-    await ws.send(
-        json.dumps({
-            "jsonrpc": "2.0",
-            "method": "printer.gcode.script",
-            "params": {
-                "script": gcode + "\nM400"
-            },
-            "id": 200
-        })
+
+def move_gcode(s):
+    gcode = "G1 " + " ".join(
+        [f"{n}{v:.3f}" for n,v in zip("XYZABC", s.positions)]
     )
+    if f := s.feedrate:
+        gcode += f" F{f:.1f}"
+    return gcode
+
+
+def gripper_gcode(s):
+    # the gripper waits for the arm to arrive
+    return f"M400\nSET_SERVO SERVO=gripper angle={s.gripper}"
+
+
+def gcodes(s):
+    if s.positions:
+        yield move_gcode(s)
+    if s.gripper:
+        yield gripper_gcode(s)
+
+
+async def run_step(rpc, s, sync=True):
+    if s.positions:
+        await run_gcode(rpc, move_gcode(s), sync)
+
+    if s.gripper:
+        await run_gcode(rpc, gripper_gcode(s), sync)
+
+
+def scripts(path, size):
+    # the gcodes of the path (with the index of their step), in scripts of
+    # up to size gcodes, each ending at the latest with a gripper gcode,
+    # which waits for the moves before it anyway
+    script = []
+    for index, s in enumerate(path):
+        for gcode in gcodes(s):
+            script.append((index, gcode))
+            if len(script) >= size or gcode.startswith("M400"):
+                yield script
+                script = []
+    if script:
+        yield script
+
+
+async def execute(path, pipelined=True, chunk=1):
+    """
+    Run the path on the arm, waiting for each move to finish before sending
+    the next one, or with pipelined, only before actuating the gripper and
+    at the end, so that klipper blends the moves. Pipelined, the gcodes go
+    in scripts of up to chunk gcodes, one call each. The progress of each
+    gcode is published to mqtt. Returns the seconds taken.
+    """
+    async with connect() as rpc:
+        progress = events.Progress(link.mqtt)
+        begin = time.perf_counter()
+
+        for script in scripts(path, chunk if pipelined else 1):
+            sent = time.time()
+            await run_gcode(rpc, "\n".join(gcode for _, gcode in script), sync=not pipelined)
+            acked = time.time()
+            for index, gcode in script:
+                # the gripper waits for the moves before it
+                complete = not pipelined or gcode.startswith("M400")
+                await progress.acked(index, gcode, sent, acked, complete)
+
+        if pipelined:
+            await run_gcode(rpc, "M400", sync=False)
+            await progress.completed(time.time())
 
-    while True:
-        resp = await ws.recv()
-        resp = json.loads(resp)
-        if "result" in resp:
-            print(resp)
-            break
-
-
-async def execute(path):
-    async with aiomqtt.Client(MQTT_BROKER_URL, port=MQTT_BROKER_PORT) as mqtt:
-        async with ws_connect(MOONRAKER_URL) as ws:
-            for s in path:
-                if pos := s.positions:
-                    gcode = "G1 " + " ".join(
-                        [f"{n}{v:.3f}" for n,v in zip("XYZABC", pos)]
-                    )
-                    await run_gcode(ws, gcode)
-
-                if gr := s.gripper:
-                    gcode = f"SET_SERVO SERVO=gripper angle={gr}"
-                    await run_gcode(ws, gcode)
+        return time.perf_counter() - begin
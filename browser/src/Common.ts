@@ -5,9 +5,21 @@ import mqtt, { MqttClient } from 'mqtt';
 export type EncodedImage = string
 export type EncodedMask = string
 
+// an image of the collection camera: a base64 string, or the extended json
+// of a BSON binary
+export type StoredImage = string | { $binary: string | { base64: string } }
+
+export function storedImageBase64(image: StoredImage): string {
+    if (typeof image === 'string') {
+        return image;
+    }
+    const binary = image.$binary;
+    return typeof binary === 'string' ? binary : binary.base64;
+}
+
 export type CapturedImage = {
     timestamp: number;
-    image: EncodedImage;
+    image: StoredImage;
 }
 
 export const Hostname = window.location.hostname
@@ -19,6 +31,7 @@ export const MongoURL = `${Hostname}:8080`;
 export const MqttURL = `ws://${Hostname}:8883`;
 export const MoonrakerURL = `ws://${KlipperHost}:7125/websocket`;
 export const DynamicsURL = `http://${Hostname}:8003`;
+export const StateTopic = '/arm/state';
 
 export interface MachineState {
     ready: boolean,
@@ -27,7 +40,28 @@ export interface MachineState {
     setHomed: React.Dispatch<React.SetStateAction<boolean>>,
 }
 
+// the state published by state_sync, positions in klipper's units
+export type ArmState = {
+    timestamp: number,
+    position: number[],
+    goal: number[],
+    velocity: number,
+    gripper?: number,
+}
+
+export function parseArmState(message: string): ArmState {
+    const s = JSON.parse(message);
+    return {
+        timestamp: s.t,
+        position: s.p,
+        goal: s.g,
+        velocity: s.v,
+        gripper: s.r,
+    };
+}
+
 export type MoonrakerMessageHandler = (record: any) => void
+export type ArmStateHandler = (state: ArmState) => void
 export type BackendProps = MachineState
 export type BackendState = {}
 
@@ -37,6 +71,7 @@ export class Backend extends React.Component<BackendProps , {}> {
     intervalRoutine: any
 
     moonrakerHandlers: { [index: number]: MoonrakerMessageHandler }
+    armStateHandlers: Set<ArmStateHandler>
 
     constructor(props: BackendProps) {
         super(props);
@@ -44,6 +79,7 @@ export class Backend extends React.Component<BackendProps , {}> {
         this.moonraker = new WebSocket(MoonrakerURL);
         this.mqttClient = mqtt.connect(MqttURL);
         this.moonrakerHandlers = {}
+        this.armStateHandlers = new Set();
     }
 
     componentDidMount() {
@@ -85,7 +121,14 @@ export class Backend extends React.Component<BackendProps , {}> {
             }
         };
 
+        // retained, the current state comes right after subscribing
+        this.mqttClient.subscribe(StateTopic);
         this.mqttClient.on('message', (topic, message) => {
+            if (topic === StateTopic) {
+                const state = parseArmState(message.toString());
+                this.armStateHandlers.forEach((handler) => handler(state));
+                return;
+            }
             console.log(topic.toString(), message.toString());
         });
     }
@@ -136,6 +179,14 @@ export class Backend extends React.Component<BackendProps , {}> {
         return old_handler;
     }
 
+    addArmStateHandler(handler: ArmStateHandler) {
+        this.armStateHandlers.add(handler);
+    }
+
+    delArmStateHandler(handler: ArmStateHandler) {
+        this.armStateHandlers.delete(handler);
+    }
+
     render() {
         return null;
     }
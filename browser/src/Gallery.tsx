@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useMemo } from "react";
 import Slider from "react-slick";
+import { storedImageBase64 } from "./Common";
 
 export default function Gallery() {
   const [page, setPage] = useState(0);
@@ -91,7 +92,7 @@ export default function Gallery() {
         {
           elems.map(elem => {
             const [idx, value] = elem;
-            const img = `data:image/png;base64,${value.image}`;
+            const img = `data:image/png;base64,${storedImageBase64(value.image)}`;
             return (
               <div key={idx}>
                 <img src={img} alt="from camera"/>
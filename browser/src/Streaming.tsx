@@ -45,7 +45,7 @@ import 'slick-carousel/slick/slick.css';
 import 'slick-carousel/slick/slick-theme.css';
 
 import {
-  Backend, CapturedImage, MongoURL,
+  Backend, CapturedImage, MongoURL, storedImageBase64,
   MqttURL, MoonrakerURL, Hostname, DynamicsURL,
   gripperStateToAngle,
 } from './Common'
@@ -606,7 +606,7 @@ export default function Streaming(props: {
           imageQueue.length === 0 ?
             <div>Loading...</div> :
           <div>
-            <img src={`data:image/jpg;base64,${imageQueue.slice(-1)[0].image}`} alt='from camera'/>
+            <img src={`data:image/jpg;base64,${storedImageBase64(imageQueue.slice(-1)[0].image)}`} alt='from camera'/>
           </div>
         }
         </div>
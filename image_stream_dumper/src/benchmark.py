@@ -0,0 +1,93 @@
+import time
+import asyncio
+import argparse
+
+import aiohttp
+from dotenv import load_dotenv
+
+from mjpeg import MultipartReader
+
+PART_BOUNDARY = b"123456789000000000000987654321"
+
+
+def concat(chunks):
+    # the former parser: a growing bytes per frame, split at the boundary
+    delimiter = b"\r\n--" + PART_BOUNDARY + b"\r\n"
+    frames = 0
+    full_chunk = b""
+    for chunk in chunks:
+        if (bpos := chunk.find(delimiter)) < 0:
+            full_chunk += chunk
+        else:
+            full_chunk += chunk[:bpos]
+            if full_chunk != b"":
+                frames += 1
+            full_chunk = chunk[bpos + len(delimiter):]
+    return frames
+
+
+def multipart(chunks):
+    reader = MultipartReader(PART_BOUNDARY)
+    frames = 0
+    for chunk in chunks:
+        frames += len(reader.feed(chunk))
+    return frames
+
+
+async def capture(args):
+    timeout = aiohttp.ClientTimeout(sock_connect=2, sock_read=2)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(args.url) as res:
+            begin = time.monotonic()
+            size = 0
+            with open(args.file, "wb") as fp:
+                async for chunk in res.content.iter_any():
+                    fp.write(chunk)
+                    size += len(chunk)
+                    if time.monotonic() - begin > args.seconds:
+                        break
+    print(f"captured {size} bytes in {args.seconds}s")
+
+
+def replay(args):
+    with open(args.file, "rb") as fp:
+        stream = fp.read()
+    chunks = [stream[i:i + args.chunk_size] for i in range(0, len(stream), args.chunk_size)]
+
+    for name, parse in [("concat", concat), ("multipart", multipart)]:
+        begin = time.perf_counter()
+        frames = parse(chunks)
+        elapsed = time.perf_counter() - begin
+        print(
+            f"{name}: {frames} frames, {frames / elapsed:.0f} frames/s, "
+            f"{len(stream) / elapsed / 1e6:.0f} MB/s"
+        )
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="capture the camera stream to a file, and replay it through the parsers at full speed",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    capture_parser = commands.add_parser("capture")
+    capture_parser.add_argument("url")
+    capture_parser.add_argument("file")
+    capture_parser.add_argument("-s", "--seconds", type=float, default=10)
+
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("-c", "--chunk-size", type=int, default=4096)
+
+    args = parser.parse_args()
+    if args.command == "capture":
+        asyncio.run(capture(args))
+    else:
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
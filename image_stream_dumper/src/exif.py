@@ -0,0 +1,135 @@
+import io
+import struct
+from datetime import datetime, timezone
+
+from PIL import Image, UnidentifiedImageError
+
+TagTiffDateTime = 0x132
+TagTiffExifIFD = 0x8769
+TagExifSubSecTime = 0x9290
+
+TYPE_ASCII = 2
+
+
+def _ifd(jpeg, tiff, offset, order):
+    # {tag: position of the entry}
+    pos = tiff + offset
+    count, = struct.unpack_from(order + "H", jpeg, pos)
+    return {
+        struct.unpack_from(order + "H", jpeg, pos + 2 + i * 12)[0]: pos + 2 + i * 12
+        for i in range(count)
+    }
+
+
+def read_ascii(jpeg, tiff, entry, order, tag):
+    """
+    The string of the IFD entry, which must be the tag
+    """
+    found, kind, n = struct.unpack_from(order + "HHI", jpeg, entry)
+    if found != tag or kind != TYPE_ASCII:
+        raise ValueError(f"expected the ascii tag {tag:#x}, found {found:#x} of type {kind}")
+    start = entry + 8 if n <= 4 else tiff + struct.unpack_from(order + "I", jpeg, entry + 8)[0]
+    return bytes(jpeg[start:start + n]).rstrip(b"\0").decode()
+
+
+def locate(jpeg):
+    """
+    Where the tags DateTime and SubSecTime are, by walking the markers of
+    the JPEG up to the APP1 segment and its TIFF directories. Returns the
+    positions of the APP1 segment and the TIFF header, the byte order, and
+    the positions of the two entries.
+    """
+    if jpeg[:2] != b"\xff\xd8":
+        raise ValueError("not a jpeg")
+
+    pos = 2
+    while pos + 4 <= len(jpeg):
+        if jpeg[pos] != 0xFF:
+            raise ValueError(f"no marker at {pos}")
+        marker = jpeg[pos + 1]
+        if marker in (0xD9, 0xDA):
+            break
+        length, = struct.unpack_from(">H", jpeg, pos + 2)
+        if marker == 0xE1 and jpeg[pos + 4:pos + 10] == b"Exif\0\0":
+            tiff = pos + 10
+            order = {b"II": "<", b"MM": ">"}[bytes(jpeg[tiff:tiff + 2])]
+            ifd0 = _ifd(jpeg, tiff, struct.unpack_from(order + "I", jpeg, tiff + 4)[0], order)
+            exif_offset, = struct.unpack_from(order + "I", jpeg, ifd0[TagTiffExifIFD] + 8)
+            exif = _ifd(jpeg, tiff, exif_offset, order)
+            return pos, tiff, order, ifd0[TagTiffDateTime], exif[TagExifSubSecTime]
+        pos += 2 + length
+    raise ValueError("no exif")
+
+
+def to_timestamp(now, millisec):
+    return datetime.fromisoformat(now).replace(
+        tzinfo=timezone.utc,
+        microsecond=int(millisec) * 1000
+    ).timestamp()
+
+
+def pil_exif(jpeg):
+    # decodes the header with PIL, for the files the parser does not handle
+    image = Image.open(io.BytesIO(jpeg))
+    exif = image.getexif()
+    return exif.get(TagTiffDateTime), exif.get_ifd(TagTiffExifIFD).get(TagExifSubSecTime)
+
+
+class TimestampReader:
+    """
+    Reads the timestamps of the frames from the EXIF tags DateTime and
+    SubSecTime, without decoding the images.
+
+    The frames of a camera share the same header layout, so the entries of
+    the two tags found in one frame are read directly in the next ones, as
+    long as their APP1 segment is at the same place with the same length
+    and TIFF header, and the entries have the expected tags. Otherwise the
+    frame is parsed again, and with PIL as the last resort.
+    """
+
+    def __init__(self):
+        self.layout = None
+        self.parsed = 0
+        self.fallbacks = 0
+
+    def _header(self, jpeg, app1):
+        # the APP1 marker and length, "Exif\0\0" and the TIFF header
+        return bytes(jpeg[app1:app1 + 18])
+
+    def _read(self, jpeg, cached):
+        if cached:
+            if self.layout is None:
+                raise ValueError("no layout yet")
+            header, (app1, tiff, order, date, subsec) = self.layout
+            if self._header(jpeg, app1) != header:
+                raise ValueError("another layout")
+        else:
+            app1, tiff, order, date, subsec = layout = locate(jpeg)
+            self.layout = self._header(jpeg, app1), layout
+            self.parsed += 1
+
+        return to_timestamp(
+            read_ascii(jpeg, tiff, date, order, TagTiffDateTime),
+            read_ascii(jpeg, tiff, subsec, order, TagExifSubSecTime),
+        )
+
+    def timestamp(self, jpeg):
+        """
+        The timestamp of the frame, or None if it has none
+        """
+        for cached in (True, False):
+            try:
+                return self._read(jpeg, cached)
+            except (ValueError, KeyError, IndexError, struct.error):
+                pass
+
+        self.layout = None
+        self.fallbacks += 1
+        try:
+            now, millisec = pil_exif(jpeg)
+            return to_timestamp(now, millisec)
+        except (UnidentifiedImageError, TypeError, ValueError):
+            return None
+
+    def timestamps(self, frames):
+        return [self.timestamp(jpeg) for jpeg in frames]
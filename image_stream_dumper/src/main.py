@@ -1,95 +1,91 @@
 import os
-import io
 import json
 import asyncio
-import base64
-from datetime import datetime, timezone
 
 import aiohttp
 import aiomqtt
-from PIL import Image, UnidentifiedImageError
+
+from exif import TimestampReader
+from mjpeg import MultipartReader
+from recorder import SegmentRecorder
+from sinks import MongoSink, RestheartSink, write_concern
+from uploader import FrameUploader
 
 PART_BOUNDARY = b"123456789000000000000987654321"
-_STREAM_BOUNDARY = (b"\r\n--" + PART_BOUNDARY + b"\r\n")
 TIME_FMT = "%Y:%m:%d %H:%M:%S.%fZ%z"
 
 CAM_STREAMING_URL = os.environ["CAM_STREAMING_URL"]
-RESTHEART_ENDPOINT = os.environ["RESTHEART_ENDPOINT"]
 MOONRAKER_URL = os.environ["MOONRAKER_URL"]
 MQTT_BROKER_URL = os.environ["MQTT_BROKER_URL"]
 
-RESTHEART_HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": "Basic " + os.environ["RESTHEART_TOKEN"]
-}
-
-TagTiffDateTime = 0x132
-TagTiffExifIFD = 0x8769
-TagExifSubSecTime = 0x9290
+# where the images go: "restheart", or "mongo" directly (requires motor),
+# into the collection "camera" of the database "restheart", or "segments"
+# on the local disk
+SINK = os.environ.get("SINK", "restheart")
+RESTHEART_ENDPOINT = os.environ.get("RESTHEART_ENDPOINT")
+RESTHEART_TOKEN = os.environ.get("RESTHEART_TOKEN")
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://mongodb1:27017/?replicaSet=rs0")
+MONGO_DATABASE = os.environ.get("MONGO_DATABASE", "restheart")
+# the write concern, e.g. 1, 0 or majority
+MONGO_W = os.environ.get("MONGO_W", "1")
+# the directory of the segments, the seconds of frames in each, and how many
+# are kept (0 for all)
+SEGMENT_DIR = os.environ.get("SEGMENT_DIR", "segments")
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", 60))
+SEGMENT_MAX = int(os.environ.get("SEGMENT_MAX", 0))
+
+# the frames are queued for UPLOAD_WORKERS, each sending batches of at most
+# UPLOAD_BATCH frames. At most UPLOAD_QUEUE frames wait, the oldest being
+# dropped when the upload cannot keep up.
+UPLOAD_QUEUE = int(os.environ.get("UPLOAD_QUEUE", 200))
+UPLOAD_BATCH = int(os.environ.get("UPLOAD_BATCH", 10))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 4))
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", 60))
 
 stopFlag = False
 recordFlag = True
 
-async def _process_chunk(session, chunk):
-
-    try:
-        cs = chunk.split(b"\r\n", 3)
-        if len(cs) != 4 or (
-            not cs[0].startswith(b"Content-Type:") or
-            not cs[1].startswith(b"Content-Length:") or
-            cs[2] != b""
-        ):
-            print("Abnormal chunk", chunk[:40])
-        chunk = cs[3]
-        image = Image.open(io.BytesIO(chunk))
-        exif = image.getexif()
-        now = exif.get(TagTiffDateTime)
-        millisec = exif.get_ifd(TagTiffExifIFD).get(TagExifSubSecTime)
-    except UnidentifiedImageError:
-        print("bad or incomplete chunk, image cannot be decoded")
-        return
+def create_sink(session):
+    if SINK == "mongo":
+        return MongoSink(MONGO_URI, MONGO_DATABASE, "camera", w=write_concern(MONGO_W))
+    if SINK == "restheart":
+        return RestheartSink(session, f"{RESTHEART_ENDPOINT}/camera", RESTHEART_TOKEN)
+    if SINK == "segments":
+        return SegmentRecorder(SEGMENT_DIR, SEGMENT_SECONDS, SEGMENT_MAX)
+    raise ValueError(f"unknown sink {SINK}")
 
-    enc = base64.b64encode(chunk)
 
-    timestamp = datetime.fromisoformat(now).replace(
-        tzinfo=timezone.utc,
-        microsecond=int(millisec) * 1000
-    ).timestamp()
+def _process_chunk(uploader, chunk, timestamp):
+
+    if timestamp is None:
+        print("bad or incomplete chunk, no timestamp found")
+        return
 
+    # the bytearray filled by the parser, stored as BSON binary by the sinks
     payload = {
         "timestamp": timestamp,
-        "image": enc.decode(),
+        "image": chunk,
     }
-    async with session.post(
-        f"{RESTHEART_ENDPOINT}/camera",
-        json=payload,
-        headers=RESTHEART_HEADERS) as res:
+    uploader.put(payload)
 
-        if res.status not in (200, 201):
-            print(f"failed to send image to restheart [{res.status}]")
 
+async def process(uploader, streaming: aiohttp.ClientResponse):
 
-async def process(session: aiohttp.ClientSession, streaming: aiohttp.ClientResponse):
+    reader = MultipartReader(PART_BOUNDARY)
+    timestamps = TimestampReader()
 
-    full_chunk = b""
-
-    async for chunk, end in streaming.content.iter_chunks():
+    async for chunk in streaming.content.iter_any():
 
         if stopFlag or not recordFlag:
             print("Recording stopped.")
             return
 
-        # assuming that the boudnary is never received in pieces
-        if (bpos := chunk.find(_STREAM_BOUNDARY)) < 0:
-            full_chunk += chunk
-        else:
-            full_chunk += chunk[:bpos]
-            if full_chunk != b"":
-                await _process_chunk(session, full_chunk)
-            full_chunk = chunk[bpos + len(_STREAM_BOUNDARY):]
+        frames = reader.feed(chunk)
+        for frame, timestamp in zip(frames, timestamps.timestamps(frames)):
+            _process_chunk(uploader, frame, timestamp)
 
 
-async def stream_receive(session):
+async def stream_receive(session, uploader):
     while True:
         # print(f"streaming {stopFlag} {recordFlag}")
         if stopFlag or not recordFlag:
@@ -106,11 +102,17 @@ async def stream_receive(session):
 
         print("Connected")
         try:
-            await process(session, res)
+            await process(uploader, res)
         except asyncio.TimeoutError:
             continue
 
 
+async def report_upload(uploader):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        print("upload:", uploader.report())
+
+
 async def check_camera_status(session):
     global stopFlag
     global recordFlag
@@ -157,11 +159,23 @@ def main():
 
     async def _ep():
         async with aiohttp.ClientSession(timeout=timeout) as session:
-            await asyncio.gather(
-                check_camera_status(session),
-                check_mqtt_command(),
-                stream_receive(session),
+            sink = create_sink(session)
+            uploader = FrameUploader(
+                sink.send,
+                max_queue=UPLOAD_QUEUE,
+                max_batch=UPLOAD_BATCH,
+                workers=UPLOAD_WORKERS,
             )
+            try:
+                await asyncio.gather(
+                    check_camera_status(session),
+                    check_mqtt_command(),
+                    stream_receive(session, uploader),
+                    uploader.run(),
+                    report_upload(uploader),
+                )
+            finally:
+                await sink.close()
     asyncio.run(_ep())
 
 
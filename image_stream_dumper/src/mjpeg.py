@@ -0,0 +1,90 @@
+MAX_HEADERS = 1024
+MAX_FRAME = 16 * 1024 * 1024
+
+_EMPTY = memoryview(b"")
+
+
+def content_length(headers):
+    for line in bytes(headers).split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class MultipartReader:
+    """
+    Incremental parser of a multipart/x-mixed-replace stream, fed with the
+    chunks as they are received, in whatever pieces.
+
+    The part headers are collected until the blank line, then exactly
+    Content-Length bytes are copied into a bytearray allocated for the
+    frame, so each byte of an image is copied once. The boundary is searched
+    only between the frames, and may be split across the chunks. A part
+    without a valid Content-Length is skipped up to the next boundary.
+    """
+
+    def __init__(self, boundary):
+        self.delimiter = b"--" + boundary
+        self.pending = bytearray()
+        self.in_part = False
+        self.frame = None
+        self.filled = 0
+        self.skipped = 0
+
+    def feed(self, chunk):
+        """
+        The frames completed by the chunk, as bytearrays
+        """
+        frames = []
+        view = memoryview(chunk)
+        while view:
+            if self.frame is None:
+                self.pending += view
+                view = self._parse()
+                continue
+
+            n = min(len(self.frame) - self.filled, len(view))
+            self.frame[self.filled:self.filled + n] = view[:n]
+            self.filled += n
+            view = view[n:]
+            if self.filled == len(self.frame):
+                frames.append(self.frame)
+                self.frame = None
+        return frames
+
+    def _parse(self):
+        # the bytes following the headers, once a frame is allocated
+        if not self.in_part:
+            pos = self.pending.find(self.delimiter)
+            if pos < 0:
+                # keep what could be the beginning of a split boundary
+                del self.pending[:max(0, len(self.pending) - len(self.delimiter) + 1)]
+                return _EMPTY
+            del self.pending[:pos + len(self.delimiter)]
+            self.in_part = True
+
+        end = self.pending.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self.pending) > MAX_HEADERS:
+                self._skip("headers too long")
+                return self._parse()
+            return _EMPTY
+
+        length = content_length(self.pending[:end])
+        pending, self.pending = self.pending, bytearray()
+        self.in_part = False
+        if length is None or not 0 < length <= MAX_FRAME:
+            self._skip(f"bad content length {length}")
+        else:
+            self.frame = bytearray(length)
+            self.filled = 0
+        return memoryview(pending)[end + 4:]
+
+    def _skip(self, reason):
+        print(f"skipping a part, {reason}")
+        self.skipped += 1
+        self.in_part = False
@@ -0,0 +1,69 @@
+import os
+import struct
+
+# an entry of the index per frame: timestamp, offset and length in the data
+# file. utils/extract_dataset.py reads the same format.
+INDEX = struct.Struct("<dQI")
+
+
+class SegmentRecorder:
+    """
+    Sink writing the frames to rolling segments on the local disk, rather
+    than a document each. A segment is a data file of the JPEGs appended
+    one after another (a valid MJPEG stream), and an index file of fixed
+    size entries, both named by the timestamp of the first frame in ms.
+
+    A new segment is started every segment_seconds, and with max_segments
+    the oldest ones are deleted beyond it.
+    """
+
+    def __init__(self, directory, segment_seconds=60, max_segments=0):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.begin = None
+        self.data = None
+        self.index = None
+        self.offset = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _close_segment(self):
+        if self.data is not None:
+            self.data.close()
+            self.index.close()
+            self.data = self.index = None
+
+    def _open_segment(self, timestamp):
+        self._close_segment()
+        path = os.path.join(self.directory, f"{round(timestamp * 1000):016d}")
+        self.data = open(path + ".mjpeg", "ab")
+        self.index = open(path + ".idx", "ab")
+        self.offset = self.data.tell()
+        self.begin = timestamp
+        self._remove_segments()
+
+    def _remove_segments(self):
+        if not self.max_segments:
+            return
+        names = sorted(n[:-4] for n in os.listdir(self.directory) if n.endswith(".idx"))
+        for name in names[:-self.max_segments]:
+            for ext in (".idx", ".mjpeg"):
+                os.remove(os.path.join(self.directory, name + ext))
+
+    async def send(self, documents):
+        for doc in documents:
+            if self.data is None or doc["timestamp"] - self.begin >= self.segment_seconds:
+                self._open_segment(doc["timestamp"])
+
+            image = doc["image"]
+            self.data.write(image)
+            self.index.write(INDEX.pack(doc["timestamp"], self.offset, len(image)))
+            self.offset += len(image)
+
+        # the data first, so that the index never points beyond it
+        if self.data is not None:
+            self.data.flush()
+            self.index.flush()
+
+    async def close(self):
+        self._close_segment()
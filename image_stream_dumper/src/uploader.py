@@ -0,0 +1,78 @@
+import asyncio
+from collections import deque
+
+
+class FrameUploader:
+    """
+    Uploads the frames from a bounded queue, decoupled from the reading of
+    the stream. Each of the workers sends the queued frames in batches of
+    at most max_batch, so at most workers requests are in flight.
+
+    When the queue is full, the oldest frame is dropped, the reader never
+    waits for the upload. A failed batch goes back to the front of the
+    queue, and its worker pauses for backoff seconds.
+    """
+
+    def __init__(self, send, max_queue=200, max_batch=10, workers=4, backoff=1):
+        self.send = send
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.workers = workers
+        self.backoff = backoff
+        self.frames = deque()
+        self.available = asyncio.Event()
+
+        self.received = 0
+        self.uploaded = 0
+        self.dropped = 0
+        self.failures = 0
+        self.batches = 0
+        self.in_flight = 0
+
+    def _trim(self):
+        while len(self.frames) > self.max_queue:
+            self.frames.popleft()
+            self.dropped += 1
+
+    def put(self, frame):
+        self.received += 1
+        self.frames.append(frame)
+        self._trim()
+        self.available.set()
+
+    async def _worker(self):
+        while True:
+            while not self.frames:
+                self.available.clear()
+                await self.available.wait()
+
+            batch = [self.frames.popleft() for _ in range(min(self.max_batch, len(self.frames)))]
+            self.in_flight += 1
+            try:
+                await self.send(batch)
+            except Exception as e:
+                self.failures += 1
+                print(f"failed to upload {len(batch)} frames, retrying in {self.backoff}s: {e!r}")
+                self.frames.extendleft(reversed(batch))
+                self._trim()
+            else:
+                self.uploaded += len(batch)
+                self.batches += 1
+                continue
+            finally:
+                self.in_flight -= 1
+            await asyncio.sleep(self.backoff)
+
+    async def run(self):
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+
+    def report(self):
+        return {
+            "received": self.received,
+            "uploaded": self.uploaded,
+            "dropped": self.dropped,
+            "pending": len(self.frames),
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+            "batches": self.batches,
+        }
@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+import argparse
+
+import aiohttp
+from dotenv import load_dotenv
+
+from sinks import MongoSink, RestheartSink, write_concern
+
+
+def make_states(count):
+    return [
+        {
+            "timestamp": time.time(),
+            "homed": True,
+            "position": [i * 0.001] * 6,
+            "goal": [i * 0.001] * 6,
+            "velocity": 0.0,
+            "gripper": 30.0,
+        }
+        for i in range(count)
+    ]
+
+
+async def run(sink, states, batch):
+    begin = time.perf_counter()
+    for i in range(0, len(states), batch):
+        await sink.send(states[i:i + batch])
+    return len(states) / (time.perf_counter() - begin)
+
+
+async def _main(args):
+    states = make_states(args.count)
+
+    async with aiohttp.ClientSession() as session:
+        sinks = {}
+        if args.restheart_url:
+            sinks["restheart"] = lambda: RestheartSink(
+                session, f"{args.restheart_url}/{args.collection}", os.environ["RESTHEART_TOKEN"]
+            )
+        if args.mongo_uri:
+            sinks["mongo"] = lambda: MongoSink(
+                args.mongo_uri, args.database, args.collection, w=write_concern(args.w)
+            )
+
+        for name, create in sinks.items():
+            sink = create()
+            try:
+                rate = await run(sink, states, args.batch)
+            finally:
+                await sink.close()
+            print(f"{name}: {rate:.0f} records/s")
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="insert synthetic states with each sink and compare the records per second",
+    )
+    parser.add_argument("-n", "--count", type=int, default=10000)
+    parser.add_argument("-b", "--batch", type=int, default=100)
+    parser.add_argument("--collection", default="benchmark")
+    parser.add_argument("--restheart-url", default=os.environ.get("RESTHEART_ENDPOINT"))
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI"))
+    parser.add_argument("--database", default="restheart")
+    parser.add_argument("-w", default="1", help="the write concern of mongo")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
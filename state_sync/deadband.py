@@ -0,0 +1,76 @@
+class Deadband:
+    """
+    Keeps a state only if it differs from the last kept one by more than
+    the thresholds (in klipper's units, and in degrees for the gripper), or
+    if keyframe seconds have passed since. With keyframe 0, all the states
+    are kept.
+
+    When a state is kept after some skipped ones, the last skipped one is
+    kept before it, so that interpolating between the kept states gives the
+    same as between all of them: constant while idle, then the move.
+    """
+
+    def __init__(self, position=1e-3, velocity=1e-3, gripper=0.5, keyframe=10):
+        self.position = position
+        self.velocity = velocity
+        self.gripper = gripper
+        self.keyframe = keyframe
+        self.kept = None
+        self.skipped = None
+        # when the last state came from klipper
+        self.seen = None
+        self.suppressed = 0
+
+    def reset(self):
+        """
+        Forget the kept state, when the arm is no longer homed
+        """
+        self.kept = None
+        self.skipped = None
+
+    def _changed(self, a, b):
+        for key in ("position", "goal"):
+            if any(abs(x - y) > self.position for x, y in zip(a[key], b[key])):
+                return True
+
+        if abs(a["velocity"] - b["velocity"]) > self.velocity:
+            return True
+
+        ga, gb = a.get("gripper"), b.get("gripper")
+        if (ga is None) != (gb is None):
+            return True
+        return ga is not None and abs(ga - gb) > self.gripper
+
+    def filter(self, payload):
+        """
+        The states to keep, given the new one
+        """
+        self.seen = payload["timestamp"]
+        return self._filter(payload)
+
+    def _filter(self, payload):
+        kept = []
+        if self.kept is not None and self._changed(self.kept, payload):
+            if self.skipped is not None:
+                kept.append(self.skipped)
+        elif self.kept is not None and payload["timestamp"] - self.kept["timestamp"] < self.keyframe:
+            self.skipped = payload
+            self.suppressed += 1
+            return kept
+
+        kept.append(payload)
+        self.kept = payload
+        self.skipped = None
+        return kept
+
+    def heartbeat(self, now):
+        """
+        The states to keep when no new state came: the latest one repeated
+        at now, once a keyframe is due, as long as klipper sent a state
+        within the last keyframe seconds
+        """
+        if self.kept is None or not self.keyframe or now - self.kept["timestamp"] < self.keyframe:
+            return []
+        if now - self.seen >= self.keyframe:
+            return []
+        return self._filter(dict(self.skipped or self.kept, timestamp=now))
@@ -6,11 +6,70 @@ import asyncio
 import aiohttp
 from dotenv import load_dotenv
 
+from deadband import Deadband
+from publisher import StatePublisher
+from segment_log import SegmentLog
+from sinks import MongoSink, RestheartSink, write_concern
+from uploader import MemoryBuffer, Uploader
+
 load_dotenv()
 KLIPPER_SOCKET = os.environ["KLIPPER_SOCKET"]
-RESTHEART_URL = os.environ["RESTHEART_URL"]
-RESTHEART_TOKEN = os.environ["RESTHEART_TOKEN"]
 
+# where the states go: "restheart", or "mongo" directly (requires motor).
+# The collection of RESTHeart is in the database "restheart".
+SINK = os.environ.get("SINK", "restheart")
+RESTHEART_URL = os.environ.get("RESTHEART_URL")
+RESTHEART_TOKEN = os.environ.get("RESTHEART_TOKEN")
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DATABASE = os.environ.get("MONGO_DATABASE", "restheart")
+MONGO_COLLECTION = os.environ.get("MONGO_COLLECTION", "robot")
+# the write concern, e.g. 1, 0 or majority
+MONGO_W = os.environ.get("MONGO_W", "1")
+
+
+# every state is also published to STATE_TOPIC, if MQTT_BROKER_URL is set
+MQTT_BROKER_URL = os.environ.get("MQTT_BROKER_URL")
+MQTT_BROKER_PORT = int(os.environ.get("MQTT_BROKER_PORT", 1883))
+STATE_TOPIC = os.environ.get("STATE_TOPIC", "/arm/state")
+
+# "query" klipper FPS times a second, or "subscribe" to its status updates.
+# Both are limited by the 250ms refresh of klipper's status, i.e. 4 states
+# a second at most.
+STATE_MODE = os.environ.get("STATE_MODE", "query")
+
+# the states are uploaded in batches of UPLOAD_BATCH, or less if the first
+# one has waited UPLOAD_LINGER seconds, or UPLOAD_DRAIN_BATCH for a backlog.
+# In memory, at most UPLOAD_QUEUE states are kept while the upload is slow,
+# dropping the "oldest" or the "newest" ones.
+UPLOAD_BATCH = int(os.environ.get("UPLOAD_BATCH", 10))
+UPLOAD_LINGER = float(os.environ.get("UPLOAD_LINGER", 5))
+UPLOAD_QUEUE = int(os.environ.get("UPLOAD_QUEUE", 10000))
+UPLOAD_DROP = os.environ.get("UPLOAD_DROP", "oldest")
+UPLOAD_DRAIN_BATCH = int(os.environ.get("UPLOAD_DRAIN_BATCH", 500))
+# the directory of the log on disk where the states are written first,
+# keeping at most STATE_LOG_SEGMENTS segments of 65536 states (about 8MB
+# each). Set it empty to keep the states in memory only, bounded by
+# UPLOAD_QUEUE.
+STATE_LOG = os.environ.get("STATE_LOG", "log")
+STATE_LOG_SEGMENTS = int(os.environ.get("STATE_LOG_SEGMENTS", 64))
+FLUSH_INTERVAL = 1
+# a state is recorded only if a joint (in klipper's units), the velocity or
+# the gripper (in degrees) changed beyond these, or every STATE_KEYFRAME
+# seconds. STATE_KEYFRAME=0 records all the states.
+DEADBAND_POSITION = float(os.environ.get("DEADBAND_POSITION", 0.001))
+DEADBAND_VELOCITY = float(os.environ.get("DEADBAND_VELOCITY", 0.001))
+DEADBAND_GRIPPER = float(os.environ.get("DEADBAND_GRIPPER", 0.5))
+STATE_KEYFRAME = float(os.environ.get("STATE_KEYFRAME", 10))
+STATS_INTERVAL = 60
+
+# estimated_print_time changes on every refresh, so that klipper keeps
+# sending updates in the subscribe mode while the arm is idle
+OBJECTS = {
+    "toolhead": ["homed_axes", "estimated_print_time"],
+    "gcode_move": ["gcode_position"],
+    "motion_report": ["live_position", "live_velocity"],
+    "servo gripper": ["value"],
+}
 
 last_timestamp = 0
 FPS = 5
@@ -28,21 +87,50 @@ def gripper_state_to_angle(value: float):
     return (value - 0.045) * 1125
 
 
-async def query_moonraker(reader, writer, queue):
+def make_payload(status, timestamp):
+    homed_axes = status["toolhead"]["homed_axes"]
+    position = status["motion_report"]["live_position"]
+    velocity = status["motion_report"]["live_velocity"]
+    goal = status["gcode_move"]["gcode_position"]
+
+    gripper = status["servo gripper"].get("value")
+
+    homed = homed_axes == "xyzabc"
+    if not homed:
+        return None
+
+    payload = {
+        "timestamp": timestamp,
+        "homed": homed,
+        "position": position[:6],
+        "goal": goal[:6],
+        "velocity": velocity,
+    }
+    if gripper:
+        payload["gripper"] = gripper_state_to_angle(gripper)
+    return payload
+
+
+def count_fps():
     global last_timestamp
     global fps
     global fps_counter_last_timestamp
 
+    last_timestamp = time.time()
+    fps += 1
+
+    if last_timestamp - fps_counter_last_timestamp > 5:
+        print("fps:", fps / 5)
+        fps = 0
+        fps_counter_last_timestamp = last_timestamp
+
+
+async def query_moonraker(reader, writer, record):
     query_json = json.dumps({
         "id": 100,
         "method": "objects/query",
         "params": {
-            "objects": {
-                "toolhead": ["homed_axes"],
-                "gcode_move": ["gcode_position"],
-                "motion_report": ["live_position", "live_velocity"],
-                "servo gripper": ["value"],
-            }
+            "objects": OBJECTS,
         }
     }, separators=(",", ":"))
 
@@ -51,78 +139,136 @@ async def query_moonraker(reader, writer, queue):
         writer.write(f"{query_json}\x03".encode())
         resp= await reader.readuntil(b"\x03")
         resp = json.loads(resp[:-1])
-        status = resp["result"]["status"]
-        homed_axes = status["toolhead"]["homed_axes"]
-        position = status["motion_report"]["live_position"]
-        velocity = status["motion_report"]["live_velocity"]
-        goal = status["gcode_move"]["gcode_position"]
-
-        gripper = status["servo gripper"].get("value")
-
-        homed = homed_axes == "xyzabc"
-        if homed:
-            payload = {
-                "timestamp": query_timestamp,
-                "homed": homed,
-                "position": position[:6],
-                "goal": goal[:6],
-                "velocity": velocity,
-            }
-            if gripper:
-                payload["gripper"] = gripper_state_to_angle(gripper)
-            await queue.put(payload)
+
+        record(make_payload(resp["result"]["status"], query_timestamp))
 
         elasp = time.time() - last_timestamp
 
         if (elasp < perframe):
             await asyncio.sleep(perframe - elasp)
 
-        last_timestamp = time.time()
-        fps += 1
+        count_fps()
 
-        if last_timestamp - fps_counter_last_timestamp > 5:
-            print("fps:", fps / 5)
-            fps = 0
-            fps_counter_last_timestamp = last_timestamp
 
+async def subscribe_moonraker(reader, writer, record):
+    """
+    Klipper sends the full status in the reply to objects/subscribe, and
+    then only the changed fields, every 250ms while anything changes. They
+    are merged into the current status, which is recorded timestamped when
+    the update arrived.
+    """
+    subscribe_json = json.dumps({
+        "id": 101,
+        "method": "objects/subscribe",
+        "params": {
+            "objects": OBJECTS,
+            "response_template": {"method": "status_update"},
+        }
+    }, separators=(",", ":"))
+    writer.write(f"{subscribe_json}\x03".encode())
 
-async def sync_state(session, queue):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": "Basic " + RESTHEART_TOKEN,
-    }
-
-    batch = []
+    status = None
 
     while(True):
-        start_time = time.time()
-        while len(batch) < 10:
-            try:
-                batch.append(queue.get_nowait())
-            except asyncio.QueueEmpty:
-                # wait for more, send anyway if timeout
-                if time.time() - start_time > 5:
-                    break
-                await asyncio.sleep(0)
-
-        if not batch:
-            await asyncio.sleep(0)
+        resp = await reader.readuntil(b"\x03")
+        arrival = time.time()
+        resp = json.loads(resp[:-1])
+
+        if resp.get("id") == 101:
+            status = resp["result"]["status"]
+        elif resp.get("method") == "status_update" and status is not None:
+            for name, fields in resp["params"]["status"].items():
+                status.setdefault(name, {}).update(fields)
+        else:
             continue
 
-        try:
-            await session.post(RESTHEART_URL, json=batch, headers=headers, raise_for_status=True)
-            batch = []
-        except aiohttp.ClientResponseError as e:
-            print("error in sync", e)
+        record(make_payload(status, arrival))
+
+        count_fps()
+
+
+def create_sink(session):
+    if SINK == "mongo":
+        return MongoSink(
+            MONGO_URI, MONGO_DATABASE, MONGO_COLLECTION, w=write_concern(MONGO_W)
+        )
+    if SINK == "restheart":
+        return RestheartSink(session, RESTHEART_URL, RESTHEART_TOKEN)
+    raise ValueError(f"unknown sink {SINK}")
+
+
+async def flush_log(log):
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        log.flush()
+
+
+async def emit_keyframes(deadband, uploader):
+    # the keyframes are driven by a timer as well, between the states from
+    # klipper, but stop with them
+    while True:
+        await asyncio.sleep(min(1, STATE_KEYFRAME))
+        for kept in deadband.heartbeat(time.time()):
+            uploader.put(kept)
+
+
+async def report_upload(uploader, deadband):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        print("upload:", uploader.report(), "suppressed:", deadband.suppressed)
 
 
 async def main():
     reader, writer = await asyncio.open_unix_connection(KLIPPER_SOCKET)
     async with aiohttp.ClientSession() as session:
-        queue = asyncio.Queue()
-        task1 = query_moonraker(reader, writer,queue)
-        task2 = sync_state(session, queue)
-        await asyncio.gather(task1, task2)
+        if STATE_LOG:
+            buffer = SegmentLog(STATE_LOG, max_segments=STATE_LOG_SEGMENTS)
+            print(f"{len(buffer)} states in the log to upload")
+        else:
+            buffer = MemoryBuffer(max_queue=UPLOAD_QUEUE, drop=UPLOAD_DROP)
+
+        sink = create_sink(session)
+        uploader = Uploader(
+            sink.send,
+            buffer,
+            max_batch=UPLOAD_BATCH,
+            linger=UPLOAD_LINGER,
+            drain_batch=UPLOAD_DRAIN_BATCH,
+        )
+        deadband = Deadband(
+            position=DEADBAND_POSITION,
+            velocity=DEADBAND_VELOCITY,
+            gripper=DEADBAND_GRIPPER,
+            keyframe=STATE_KEYFRAME,
+        )
+
+        publisher = None
+        if MQTT_BROKER_URL:
+            publisher = StatePublisher(MQTT_BROKER_URL, MQTT_BROKER_PORT, STATE_TOPIC)
+
+        def record(payload):
+            # None while the arm is not homed
+            if payload is None:
+                deadband.reset()
+                return
+            if publisher:
+                publisher.put(payload)
+            for kept in deadband.filter(payload):
+                uploader.put(kept)
+
+        capture = subscribe_moonraker if STATE_MODE == "subscribe" else query_moonraker
+        tasks = [
+            capture(reader, writer, record),
+            uploader.run(),
+            report_upload(uploader, deadband),
+        ]
+        if STATE_KEYFRAME:
+            tasks.append(emit_keyframes(deadband, uploader))
+        if STATE_LOG:
+            tasks.append(flush_log(buffer))
+        if publisher:
+            tasks.append(publisher.run())
+        await asyncio.gather(*tasks)
 
 
 if __name__ == "__main__":
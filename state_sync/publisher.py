@@ -0,0 +1,56 @@
+import json
+import asyncio
+
+
+def compact(payload):
+    # t: timestamp, p: position, g: goal, v: velocity, r: gripper
+    state = {
+        "t": round(payload["timestamp"], 3),
+        "p": [round(v, 4) for v in payload["position"]],
+        "g": [round(v, 4) for v in payload["goal"]],
+        "v": round(payload["velocity"], 4),
+    }
+    if (gripper := payload.get("gripper")) is not None:
+        state["r"] = round(gripper, 1)
+    return json.dumps(state, separators=(",", ":"))
+
+
+class StatePublisher:
+    """
+    Publishes the latest state to mqtt as a retained message, so that a
+    new subscriber gets the current state right away. The states coming
+    faster than they can be published are skipped, the capture never
+    waits for mqtt.
+
+    Requires aiomqtt, which is imported only when this is used.
+    """
+
+    def __init__(self, host, port, topic):
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.latest = None
+        self.available = asyncio.Event()
+        self.published = 0
+
+    def put(self, payload):
+        self.latest = payload
+        self.available.set()
+
+    async def run(self):
+        import aiomqtt
+
+        delay = 1
+        while True:
+            try:
+                async with aiomqtt.Client(self.host, port=self.port) as client:
+                    delay = 1
+                    while True:
+                        await self.available.wait()
+                        self.available.clear()
+                        await client.publish(self.topic, compact(self.latest), retain=True)
+                        self.published += 1
+            except aiomqtt.MqttError as e:
+                print(f"mqtt error, reconnecting in {delay}s:", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
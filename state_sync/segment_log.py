@@ -0,0 +1,176 @@
+import os
+import math
+import mmap
+import struct
+
+# timestamp, position, goal, velocity, gripper (nan if none), homed. The
+# timestamp is written last, a record is valid only if it is not 0.
+TIMESTAMP = struct.Struct("<d")
+BODY = struct.Struct("<6d6dddB")
+RECORD_SIZE = TIMESTAMP.size + BODY.size
+
+CHECKPOINT = "checkpoint"
+
+
+def encode(buffer, offset, payload):
+    BODY.pack_into(
+        buffer, offset + TIMESTAMP.size,
+        *payload["position"],
+        *payload["goal"],
+        payload["velocity"],
+        payload.get("gripper", math.nan),
+        payload["homed"],
+    )
+    TIMESTAMP.pack_into(buffer, offset, payload["timestamp"])
+
+
+def decode(buffer, offset):
+    timestamp, = TIMESTAMP.unpack_from(buffer, offset)
+    values = BODY.unpack_from(buffer, offset + TIMESTAMP.size)
+    payload = {
+        "timestamp": timestamp,
+        "homed": bool(values[14]),
+        "position": list(values[0:6]),
+        "goal": list(values[6:12]),
+        "velocity": values[12],
+    }
+    if not math.isnan(values[13]):
+        payload["gripper"] = values[13]
+    return payload
+
+
+class Segment:
+    def __init__(self, path, first, records):
+        self.path = path
+        self.first = first
+        self.records = records
+
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(records * RECORD_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), records * RECORD_SIZE)
+
+    def count(self):
+        # the number of valid records, which are contiguous from the start
+        lo, hi = 0, self.records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if TIMESTAMP.unpack_from(self.map, mid * RECORD_SIZE)[0] != 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class SegmentLog:
+    """
+    Append-only log of the states on disk, in memory-mapped segments of
+    fixed-size binary records, numbered by a sequence across segments.
+
+    The states are appended first, and read from the oldest unacknowledged
+    one. The sequence up to which they are acknowledged is checkpointed, so
+    that the upload resumes there after a restart, and the segments before
+    it are deleted. At most max_segments are kept, dropping the oldest one
+    when full.
+    """
+
+    def __init__(self, directory, segment_records=65536, max_segments=64):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.begin = self._read_checkpoint()
+        self.segments = [
+            Segment(os.path.join(directory, name), int(name[:-4]), segment_records)
+            for name in sorted(os.listdir(directory)) if name.endswith(".seg")
+        ]
+
+        if self.segments:
+            last = self.segments[-1]
+            self.end = last.first + last.count()
+            self.begin = max(self.begin, self.segments[0].first)
+        else:
+            self.end = self.begin
+            self._add_segment()
+
+    def _segment_path(self, first):
+        return os.path.join(self.directory, f"{first:016d}.seg")
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT)) as fp:
+                return int(fp.read())
+        except FileNotFoundError:
+            return 0
+
+    def _write_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT)
+        with open(path + ".tmp", "w") as fp:
+            fp.write(str(self.begin))
+        os.replace(path + ".tmp", path)
+
+    def _add_segment(self):
+        self.segments.append(
+            Segment(self._segment_path(self.end), self.end, self.segment_records)
+        )
+        if len(self.segments) > self.max_segments:
+            oldest = self.segments[1].first
+            self.dropped += max(0, oldest - self.begin)
+            self.begin = max(self.begin, oldest)
+            self._write_checkpoint()
+            self._remove_segments()
+
+    def _remove_segments(self):
+        # the segments entirely before begin, except the one being written
+        while len(self.segments) > 1 and self.segments[1].first <= self.begin:
+            segment = self.segments.pop(0)
+            segment.close()
+            os.remove(segment.path)
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def put(self, payload):
+        last = self.segments[-1]
+        if self.end - last.first == last.records:
+            last.map.flush()
+            self._add_segment()
+            last = self.segments[-1]
+
+        encode(last.map, (self.end - last.first) * RECORD_SIZE, payload)
+        self.end += 1
+
+    def read(self, limit):
+        """
+        Up to limit of the oldest unacknowledged states, as (timestamp,
+        payload), and the sequence to acknowledge them
+        """
+        items = []
+        seq = self.begin
+        for segment in self.segments:
+            while seq < min(self.end, segment.first + segment.records) and len(items) < limit:
+                payload = decode(segment.map, (seq - segment.first) * RECORD_SIZE)
+                items.append((payload["timestamp"], payload))
+                seq += 1
+        return items, seq
+
+    def ack(self, seq):
+        if seq <= self.begin:
+            return
+        self.begin = seq
+        self._write_checkpoint()
+        self._remove_segments()
+
+    def flush(self):
+        self.segments[-1].map.flush()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
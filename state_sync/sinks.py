@@ -0,0 +1,58 @@
+import json
+
+
+class RestheartSink:
+    """
+    Inserts the documents by posting them as a json array to a collection
+    of RESTHeart
+    """
+
+    def __init__(self, session, url, token):
+        self.session = session
+        self.url = url
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Basic " + token,
+        }
+
+    async def send(self, documents):
+        async with self.session.post(
+            self.url,
+            data=json.dumps(documents),
+            headers=self.headers,
+            raise_for_status=True,
+        ):
+            pass
+
+    async def close(self):
+        pass
+
+
+class MongoSink:
+    """
+    Inserts the documents straight into MongoDB with an unordered
+    insert_many. w and journal are the write concern.
+
+    Requires motor, which is imported only when this sink is used.
+    """
+
+    def __init__(self, uri, database, collection, w=1, journal=None):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from pymongo import WriteConcern
+
+        self.client = AsyncIOMotorClient(uri)
+        self.collection = self.client[database].get_collection(
+            collection, write_concern=WriteConcern(w=w, j=journal)
+        )
+
+    async def send(self, documents):
+        # copies, as insert_many adds the _id to the documents
+        await self.collection.insert_many([dict(d) for d in documents], ordered=False)
+
+    async def close(self):
+        self.client.close()
+
+
+def write_concern(w):
+    # a number of nodes, or a tag like "majority"
+    return int(w) if w.isdigit() else w
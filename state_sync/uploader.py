@@ -0,0 +1,137 @@
+import time
+import asyncio
+from collections import deque
+
+
+class MemoryBuffer:
+    """
+    The states waiting for upload, in memory. It holds at most max_queue
+    of them, and drops the oldest or the newest ones (by the policy drop)
+    when it is full.
+    """
+
+    def __init__(self, max_queue=10000, drop="oldest"):
+        if drop not in ("oldest", "newest"):
+            raise ValueError(f"unknown drop policy {drop}")
+
+        self.max_queue = max_queue
+        self.drop = drop
+        # (enqueue time, item), the first one numbered begin
+        self.items = deque()
+        self.begin = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        if len(self.items) >= self.max_queue:
+            self.dropped += 1
+            if self.drop == "newest":
+                return
+            self.items.popleft()
+            self.begin += 1
+
+        self.items.append((time.time(), item))
+
+    def read(self, limit):
+        items = [self.items[i] for i in range(min(limit, len(self.items)))]
+        return items, self.begin + len(items)
+
+    def ack(self, seq):
+        while self.begin < seq and self.items:
+            self.items.popleft()
+            self.begin += 1
+
+
+class Uploader:
+    """
+    Uploads the items of the buffer in batches of at most max_batch,
+    sending a smaller batch when its first item has waited linger seconds.
+    A backlog is sent in batches of drain_batch.
+    The items stay in the buffer until they are sent, and a failed batch
+    is retried after a delay doubling from backoff_min up to backoff_max.
+
+    The buffer is either a MemoryBuffer or a SegmentLog on disk.
+    """
+
+    def __init__(self, send, buffer, max_batch=10, linger=5, drain_batch=500,
+                 backoff_min=0.5, backoff_max=60):
+        self.send = send
+        self.buffer = buffer
+        self.max_batch = max_batch
+        self.drain_batch = drain_batch
+        self.linger = linger
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.available = asyncio.Event()
+
+        self.queued = 0
+        self.sent = 0
+        self.failures = 0
+        self.batches = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def put(self, item):
+        self.buffer.put(item)
+        self.queued += 1
+        self.available.set()
+
+    async def _wait(self, timeout=None):
+        self.available.clear()
+        try:
+            await asyncio.wait_for(self.available.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _next_batch(self):
+        while not len(self.buffer):
+            await self._wait()
+
+        # wait for a full batch, or for the first item to linger enough
+        deadline = self.buffer.read(1)[0][0][0] + self.linger
+        while len(self.buffer) < self.max_batch and (remaining := deadline - time.time()) > 0:
+            await self._wait(remaining)
+
+        # a backlog, e.g. after an outage, is sent in larger batches
+        if len(self.buffer) > self.max_batch:
+            return self.buffer.read(self.drain_batch)
+        return self.buffer.read(self.max_batch)
+
+    async def _send(self, batch):
+        delay = self.backoff_min
+        while True:
+            try:
+                await self.send([item for _, item in batch])
+                return
+            except Exception as e:
+                self.failures += 1
+                print(f"error in sync, retrying in {delay}s:", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+
+    async def run(self):
+        while True:
+            batch, seq = await self._next_batch()
+            await self._send(batch)
+            self.buffer.ack(seq)
+
+            now = time.time()
+            self.batches += 1
+            self.sent += len(batch)
+            for enqueued, _ in batch:
+                self.latency_total += now - enqueued
+            self.latency_max = max(self.latency_max, now - batch[0][0])
+
+    def report(self):
+        return {
+            "queued": self.queued,
+            "pending": len(self.buffer),
+            "sent": self.sent,
+            "dropped": self.buffer.dropped,
+            "failures": self.failures,
+            "batches": self.batches,
+            "mean_latency": self.latency_total / self.sent if self.sent else None,
+            "max_latency": self.latency_max,
+        }
@@ -43,6 +43,25 @@ async def run_gcode(ws, gcode):
             break
 
 
+def script(path, position_key, gripper_state_key):
+    # all the steps in one script, waiting only before actuating the gripper
+    lines = []
+    for s in path:
+        pos = s[position_key]
+        lines.append("G1 " + " ".join([f"{n}{v:.3f}" for n,v in zip("XYZABC", pos)]))
+
+        gr = None
+        if gripper_state_key:
+            gr = s[gripper_state_key]
+        elif len(s[position_key]) == 7:
+            gr = s[position_key][-1]
+
+        if gr:
+            lines.append("M400")
+            lines.append(f"SET_SERVO SERVO=gripper angle={gr}")
+    return "\n".join(lines)
+
+
 async def execute(path, args, start_record_at=1, position_key="positions", gripper_state_key: str | None ="gripper"):
     async with aiomqtt.Client(MQTT_SERVER_HOST, port=MQTT_SERVER_PORT) as mqtt:
         async with ws_connect(MOONRAKER_URL) as ws:
@@ -77,6 +96,11 @@ async def execute(path, args, start_record_at=1, position_key="positions", gripp
                     await mqtt.publish("/camera/record", "on")
                     await asyncio.sleep(4)
 
+                if args.pipelined and i >= start_record_at:
+                    # the rest of the path at once, klipper blends the moves
+                    await run_gcode(ws, script(path[i:], position_key, gripper_state_key))
+                    break
+
                 print(s)
                 pos = s[position_key]
                 gcode = "G1 " + " ".join([f"{n}{v:.3f}" for n,v in zip("XYZABC", pos)])
@@ -105,6 +129,7 @@ async def execute(path, args, start_record_at=1, position_key="positions", gripp
 
             end = time.time()
             print(f"Time frame: {begin} {end}")
+            print(f"Executed {max(len(path) - start_record_at, 0)} steps in {end - begin:.1f}s")
 
 
 def main():
@@ -114,6 +139,7 @@ def main():
     parser.add_argument("-m", "--move-to", type=int)
     parser.add_argument("-e", "--end-at", type=int)
     parser.add_argument("--from-dataset", action="store_true")
+    parser.add_argument("--pipelined", action="store_true", help="send the path as one script, without stopping at each step")
     args = parser.parse_args()
 
     with open(args.pathfile, "r") as fp:
@@ -3,10 +3,13 @@ import asyncio
 import base64
 import argparse
 import json
+import struct
 import tempfile
-from subprocess import call
+from bisect import bisect_left, bisect_right
+from subprocess import PIPE, Popen, call
 import copy
 from functools import partial
+from itertools import chain
 
 import aiohttp
 from numpy import rec
@@ -26,6 +29,19 @@ RESTHEART_HEADERS = {
 FRAMERATE = 20 # M5 Camera, VGA, roughly 20 FPS
 DELAY = 0.6 # num of sec in which images lag behind the actual states
 
+# an entry of the index of a segment recorded by image_stream_dumper:
+# timestamp, offset and length of the frame in the data file
+SEGMENT_INDEX = struct.Struct("<dQI")
+
+def image_bytes(image):
+    # the extended json of a BSON binary, or a base64 string for the frames
+    # recorded before they were stored as binary
+    if isinstance(image, dict):
+        image = image["$binary"]
+        image = image["base64"] if isinstance(image, dict) else image
+    return base64.b64decode(image)
+
+
 async def dump_images(begin, end, output_file):
     async with aiohttp.ClientSession() as session:
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -61,7 +77,7 @@ async def dump_images(begin, end, output_file):
 
                 for rec in resp:
                     timestamps.append(rec["timestamp"])
-                    bs = base64.b64decode(rec["image"])
+                    bs = image_bytes(rec["image"])
                     fn = f"{tmpdir}/{index:04d}.jpg"
                     print(f"Saving file: {fn} @ {rec['timestamp']}")
                     with open(fn, "wb") as fp:
@@ -83,6 +99,58 @@ async def dump_images(begin, end, output_file):
             return timestamps
 
 
+def segment_frames(directory, begin, end):
+    """
+    The frames between begin and end in the segments of the directory, as
+    (timestamp, jpeg), located through the index of each segment.
+    """
+    names = sorted(n[:-4] for n in os.listdir(directory) if n.endswith(".idx"))
+    starts = [int(n) / 1000 for n in names]
+
+    # the last segment starting before begin may contain it
+    for name, start in list(zip(names, starts))[max(0, bisect_right(starts, begin) - 1):]:
+        if start > end:
+            break
+
+        path = os.path.join(directory, name)
+        with open(path + ".idx", "rb") as fp:
+            index = fp.read()
+        # without a partly written entry at the end
+        entries = list(SEGMENT_INDEX.iter_unpack(index[:len(index) - len(index) % SEGMENT_INDEX.size]))
+        timestamps = [e[0] for e in entries]
+
+        with open(path + ".mjpeg", "rb") as fp:
+            for timestamp, offset, length in entries[bisect_left(timestamps, begin):bisect_right(timestamps, end)]:
+                fp.seek(offset)
+                yield timestamp, fp.read(length)
+
+
+def dump_segments(directory, begin, end, output_file):
+    # the frames are piped into ffmpeg as an mjpeg stream, without temp files
+    frames = segment_frames(directory, begin, end)
+    if (first := next(frames, None)) is None:
+        print("no frames between", begin, "and", end)
+        return []
+
+    timestamps = []
+    ffmpeg = Popen(
+        [
+            "ffmpeg", "-y", "-f", "mjpeg", "-r", str(FRAMERATE), "-i", "-",
+            "-movflags", "+use_metadata_tags",
+            "-metadata", f"timestamp0={first[0]:.3f}", output_file,
+        ],
+        stdin=PIPE,
+    )
+    for timestamp, jpeg in chain([first], frames):
+        timestamps.append(timestamp)
+        ffmpeg.stdin.write(jpeg)
+    ffmpeg.stdin.close()
+    ffmpeg.wait()
+
+    print("Saving", output_file)
+    return timestamps
+
+
 async def iter_collection(coll, begin, end):
     async with aiohttp.ClientSession() as session:
         params = {
@@ -118,20 +186,50 @@ async def iter_collection(coll, begin, end):
             page += 1
 
 
+async def get_nearest(coll, timestamp, before):
+    # the last record at or before the timestamp, or the first one after it
+    async with aiohttp.ClientSession() as session:
+        params = {
+            "filter": json.dumps(
+                {"timestamp": {"$lte" if before else "$gt": timestamp}}
+            ),
+            "sort": "-timestamp" if before else "timestamp",
+            "pagesize": 1,
+        }
+        resp = await session.get(
+            f"{RESTHEART_ENDPOINT}/{coll}",
+            params=params,
+            headers=RESTHEART_HEADERS,
+            raise_for_status=True,
+        )
+        resp = await resp.json()
+        return resp[0] if resp else None
+
+
 async def get_arm_states(begin, end):
     print(f"Getting arm states between {begin} and {end}")
-    records = []
-    async for rec in iter_collection("robot", begin, end):
-        records.append(
-            {
-                "timestamp": rec["timestamp"],
-                "goal": rec["goal"],
-                "position": rec["position"],
-                "goal": rec["goal"],
-                "velocity": rec["velocity"],
-                "gripper": rec["gripper"],
-            }
-        )
+    records = [rec async for rec in iter_collection("robot", begin, end)]
+
+    # state_sync records an idle arm only at keyframes, so the states
+    # around the range may be far before or after it
+    rec = await get_nearest("robot", begin, before=True)
+    if rec and (not records or rec["timestamp"] < records[0]["timestamp"]):
+        records.insert(0, rec)
+    rec = await get_nearest("robot", end, before=False)
+    if rec and (not records or rec["timestamp"] > records[-1]["timestamp"]):
+        records.append(rec)
+
+    records = [
+        {
+            "timestamp": rec["timestamp"],
+            "goal": rec["goal"],
+            "position": rec["position"],
+            "goal": rec["goal"],
+            "velocity": rec["velocity"],
+            "gripper": rec["gripper"],
+        }
+        for rec in records
+    ]
 
     print(f"First state: {records[0]}, last state: {records[-1]}")
     return records
@@ -230,6 +328,7 @@ def main():
     parser = argparse.ArgumentParser(prog="execute")
     parser.add_argument("--from-path", required=False)
     parser.add_argument("-o", "--output", default="output")
+    parser.add_argument("--segments", help="read the images from the segments of the directory, instead of the collection camera")
     parser.add_argument("begin", type=float)
     parser.add_argument("end", type=float)
     args = parser.parse_args()
@@ -243,9 +342,17 @@ def main():
 
         arm_timestamps = [r["timestamp"] for r in arm_records]
         print(f"Saving states between {arm_timestamps[0]} and {arm_timestamps[-1]}")
-        timestamps = await dump_images(
-            arm_timestamps[0] + DELAY, args.end + 1, f"{args.output}/{name}.mp4"
-        )
+        # the state before the range, which may be long before it if the arm
+        # was idle, is only for the interpolation
+        images_begin = max(arm_timestamps[0], args.begin - 0.5) + DELAY
+        if args.segments:
+            timestamps = dump_segments(
+                args.segments, images_begin, args.end + 1, f"{args.output}/{name}.mp4"
+            )
+        else:
+            timestamps = await dump_images(
+                images_begin, args.end + 1, f"{args.output}/{name}.mp4"
+            )
         print(timestamps[:5])
         timestamps = [t - DELAY for t in timestamps]
 